@@ -15,27 +15,67 @@ Notes
 (2) Line recognition depends on the coordinates of the detected words in the
     rectangle. These will be round to integer (pixel) values. However, use of
     different fonts, scan inaccuracies, and so on, may lead to artefacts line
-    differences, which must be handled by the caller.
+    differences. Use parameter 'tolerance' to join such lines into one row.
+
+(3) Only the words inside the rectangle are extracted. Word coordinates are
+    processed as numpy arrays: column numbers are found via 'searchsorted',
+    and if no columns are given, column borders are put in the middle of the
+    vertical gaps which are not covered by any word of the rectangle.
 
 Dependencies
 -------------
-PyMuPDF v1.12.0 or later
+PyMuPDF v1.19.0 or later, numpy
 """
 
-from operator import itemgetter
-from itertools import groupby
 import fitz
+import numpy as np
+
+
+def _irects(rects):
+    """Round float rectangles (array of shape (n, 4)) like 'Rect.irect'."""
+    rects = rects.astype(np.float32)
+    eps = np.float32(0.001)
+    return np.concatenate(
+        (np.floor(rects[:, :2] + eps), np.ceil(rects[:, 2:] - eps)), axis=1
+    ).astype(np.int64)
+
+
+def _find_columns(ir, min_gap):
+    """Column borders from the gaps between the x-intervals of the words.
+
+    Counts for every horizontal position how many words cover it. Every run
+    of at least 'min_gap' uncovered positions between the leftmost and the
+    rightmost word separates two columns. The border is its middle.
+    """
+    left = int(ir[:, 0].min())
+    cover = np.zeros(int(ir[:, 2].max()) - left + 1, dtype=np.int64)
+    np.add.at(cover, ir[:, 0] - left, 1)
+    np.add.at(cover, ir[:, 2] - left, -1)
+    used = np.flatnonzero(np.cumsum(cover))  # positions [x, x + 1) with words
+    if used.size == 0:
+        return []
+    free = np.ones(used[-1] + 1, dtype=np.int8)
+    free[used] = 0
+    free[: used[0]] = 0  # the space left of all words is no gap
+    edges = np.flatnonzero(np.diff(free)) + 1  # starts and stops of the gaps
+    starts, stops = edges[::2], edges[1::2]
+    wide = stops - starts >= min_gap
+    return [left + (a + b) / 2 for a, b in zip(starts[wide], stops[wide])]
 
 
 # ==============================================================================
 # Function ParseTab - parse a document table into a Python list of lists
 # ==============================================================================
-def ParseTab(page, bbox, columns=None):
+def ParseTab(page, bbox, columns=None, sink=None, tolerance=0, min_gap=5):
     """Returns the parsed table of a page in a PDF / (open) XPS / EPUB document.
     Parameters:
     page: fitz.Page object
     bbox: containing rectangle, list of numbers [xmin, ymin, xmax, ymax]
     columns: optional list of column coordinates. If None, columns are generated
+    sink: optional TableSink (see table_sink.py) to which the table is appended
+    tolerance: words with tops differing by at most this value from the
+      preceding word's top (sorted vertically) belong to the same row
+    min_gap: minimum width of a gap between words to generate a column border
     Returns the parsed table as a list of lists of strings.
     The number of rows is determined automatically
     from parsing the specified rectangle.
@@ -47,49 +87,61 @@ def ParseTab(page, bbox, columns=None):
         print("Warning: incorrect rectangle coordinates!")
         return []
 
-    if type(columns) is not list or columns == []:
-        coltab = [tab_rect.x0, tab_rect.x1]
-    else:
-        coltab = sorted(columns)
-
-    if xmin < min(coltab):
-        coltab.insert(0, xmin)
-    if xmax > coltab[-1]:
-        coltab.append(xmax)
-
-    words = page.get_text("words")
+    words = page.get_text("words", clip=tab_rect)
 
     if words == []:
-        print("Warning: page contains no text")
+        print("Warning: no text found in rectangle!")
         return []
 
-    alltxt = []
+    ir = _irects(np.array([w[:4] for w in words], dtype=np.float64))
+    texts = np.array([w[4] for w in words], dtype=object)
 
-    # get words contained in table rectangle and distribute them into columns
-    for w in words:
-        ir = fitz.Rect(w[:4]).irect  # word rectangle
-        if ir in tab_rect:
-            cnr = 0  # column index
-            for i in range(1, len(coltab)):  # loop over column coordinates
-                if ir.x0 < coltab[i]:  # word start left of column border
-                    cnr = i - 1
-                    break
-            alltxt.append([ir.x0, ir.y0, ir.x1, cnr, w[4]])
+    # words at the border may be cut by the clip: only keep contained ones
+    inside = (
+        (ir[:, 0] >= xmin) & (ir[:, 1] >= ymin) & (ir[:, 2] <= xmax) & (ir[:, 3] <= ymax)
+    )
+    ir, texts = ir[inside], texts[inside]
 
-    if alltxt == []:
+    if texts.size == 0:
         print("Warning: no text found in rectangle!")
         return []
 
-    alltxt.sort(key=itemgetter(1))  # sort words vertically
+    if type(columns) is not list or columns == []:
+        coltab = _find_columns(ir, min_gap)
+    else:
+        coltab = sorted(columns)
+
+    if not coltab or xmin < coltab[0]:
+        coltab.insert(0, xmin)
+    if xmax > coltab[-1]:
+        coltab.append(xmax)
+    ncols = len(coltab) - 1
+
+    # column number: the last column border not right of the word start
+    cnr = np.searchsorted(np.array(coltab), ir[:, 0], side="right") - 1
+    cnr = np.clip(cnr, 0, ncols - 1)
+
+    # row number: a new row starts where the word top jumps by more than
+    # the tolerance
+    order = np.argsort(ir[:, 1], kind="stable")  # sort words vertically
+    tops = ir[order, 1]
+    rnr = np.empty_like(tops)
+    rnr[order] = np.cumsum(np.diff(tops, prepend=tops[0]) > tolerance)
+    nrows = int(rnr.max()) + 1
+
+    # group the words by cell, each cell's words from left to right
+    order = np.lexsort((ir[:, 0], cnr, rnr))
+    cells = rnr[order] * ncols + cnr[order]
+    texts = texts[order]
+    starts = np.flatnonzero(np.diff(cells, prepend=-1))
+    stops = np.append(starts[1:], cells.size)
 
     # create the table / matrix
-    spantab = []  # the output matrix
-
-    for y, zeile in groupby(alltxt, itemgetter(1)):
-        schema = [""] * (len(coltab) - 1)
-        for c, words in groupby(zeile, itemgetter(3)):
-            entry = " ".join([w[4] for w in words])
-            schema[c] = entry
-        spantab.append(schema)
+    spantab = [[""] * ncols for _ in range(nrows)]  # the output matrix
+    for cell, start, stop in zip(cells[starts].tolist(), starts, stops):
+        spantab[cell // ncols][cell % ncols] = " ".join(texts[start:stop])
+
+    if sink is not None:  # stream to a Parquet / Arrow file
+        sink.append(spantab, page=page.number)
 
     return spantab
@@ -0,0 +1,126 @@
+"""
+Stream extracted tables to a Parquet or Arrow IPC file.
+
+Table extraction scripts like 'gridlines-to-pandas.py',
+'span-analysis-to-pandas.py' (folder "table-analysis") or 'ParseTab.py'
+(folder "examples/extract-table") deliver a table as a list of rows, each row
+being a list of strings. Class TableSink appends every such table to a
+columnar file as soon as it is available. Only a limited number of rows is
+buffered, so memory stays flat for any number of tables.
+
+All tables share one schema - one record per table row:
+
+    page   int32           page number (0-based), may be null
+    table  int32           table number
+    row    int32           row number within the table (0 = first row)
+    cells  list<string>    the strings of the row's cells
+
+A pandas DataFrame of one table can be re-created like this:
+
+    df = pd.read_parquet("tables.parquet")
+    rows = df[df.table == 5].sort_values("row").cells.tolist()
+    table = pd.DataFrame(rows[1:], columns=rows[0])  # if row 0 is the header
+
+Requires pyarrow. Identical copies of this file exist in folders
+"table-analysis" and "examples/extract-table".
+
+Usage
+------
+from table_sink import TableSink
+
+with TableSink("tables.parquet") as sink:  # or "tables.arrow"
+    for page in doc:
+        sink.append(rows, page=page.number)
+"""
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".ipc": "arrow", ".feather": "arrow"}
+
+
+def sink_format(filename):
+    """Return "parquet" or "arrow" if the file name asks for it, else None."""
+    return FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+class TableSink:
+    """Append tables as record batches to a Parquet or Arrow IPC file."""
+
+    def __init__(self, filename, batch_rows=10000):
+        """Create the file. Its format is determined by the extension.
+
+        Rows are written in batches of up to 'batch_rows' rows.
+        """
+        if pa is None:
+            raise ImportError("writing Parquet or Arrow files requires pyarrow")
+        self.format = sink_format(filename)
+        if self.format is None:
+            raise ValueError("unsupported file extension: '%s'" % filename)
+        self.schema = pa.schema(
+            [
+                ("page", pa.int32()),
+                ("table", pa.int32()),
+                ("row", pa.int32()),
+                ("cells", pa.list_(pa.string())),
+            ]
+        )
+        if self.format == "parquet":
+            self.writer = pa.parquet.ParquetWriter(filename, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(filename, self.schema)
+        self.batch_rows = batch_rows
+        self.columns = ([], [], [], [])  # buffered page, table, row, cells
+        self.tables = 0  # number of tables appended so far
+        self.rows = 0  # number of rows appended so far
+
+    def append(self, rows, page=None, table=None):
+        """Append a table given as a list of rows (lists of strings).
+
+        'table' defaults to the number of tables appended before.
+        """
+        if table is None:
+            table = self.tables
+        pages, tables, rownos, cells = self.columns
+        for i, row in enumerate(rows):
+            pages.append(page)
+            tables.append(table)
+            rownos.append(i)
+            cells.append(list(row))
+        self.tables += 1
+        self.rows += len(rows)
+        if len(rownos) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as one record batch."""
+        if not self.columns[2]:
+            return
+        batch = pa.record_batch(
+            [
+                pa.array(values, type=field.type)
+                for values, field in zip(self.columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_batch(batch)
+        self.columns = ([], [], [], [])
+
+    def close(self):
+        """Write remaining rows and close the file."""
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
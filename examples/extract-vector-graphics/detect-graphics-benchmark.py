@@ -0,0 +1,93 @@
+"""
+Utility
+--------
+Measure how 'detect_rects()' of 'detect_graphics.py' scales with the number of
+vector graphics on a page.
+
+For each requested size, a page with that many paths is generated: small
+"figures" of about 20 strokes each, scattered over a page that grows with the
+number of paths. The time for 'detect_rects()' is reported, excluding the time
+for extracting the drawings.
+
+Optionally, a reference version of 'detect_graphics.py' is measured as well -
+typically a previous one, e.g. obtained via
+
+git show <revision>:examples/extract-vector-graphics/detect_graphics.py > detect_graphics_ref.py
+
+Both versions must find identical rectangles. Because older versions may need
+hours for large pages, the reference is only run up to a maximum size.
+
+Usage
+------
+python detect-graphics-benchmark.py [-sizes 1000,10000,100000] [-reference detect_graphics_ref.py] [-reference-limit 10000]
+"""
+import argparse
+import importlib.util
+import math
+import os
+import random
+import time
+import fitz
+
+import detect_graphics
+
+
+def load_reference(filename):
+    """Import another version of detect_graphics from a file."""
+    spec = importlib.util.spec_from_file_location("detect_graphics_ref", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_graphics_page(paths, seed=0):
+    """Make a PDF page with 'paths' vector graphics, return its drawings."""
+    random.seed(seed)
+    figures = max(1, paths // 20)
+    side = max(100, math.sqrt(figures) * 60)  # about 60 x 60 points per figure
+    doc = fitz.open()
+    page = doc.new_page(width=side + 72, height=side + 72)
+    shape = page.new_shape()
+    for i in range(paths):
+        if i % 20 == 0:  # start a new figure
+            x0 = random.uniform(36, 36 + side - 30)
+            y0 = random.uniform(36, 36 + side - 30)
+        p1 = fitz.Point(x0 + random.uniform(0, 30), y0 + random.uniform(0, 30))
+        p2 = p1 + (random.uniform(-5, 5), random.uniform(-5, 5))
+        shape.draw_line(p1, p2)
+        shape.finish(color=(0, 0, 0), width=0.3)
+    shape.commit()
+    doc = fitz.open("pdf", doc.tobytes())
+    page = doc[0]
+    return doc, page, page.get_drawings()
+
+
+def run(func, page, graphics):
+    """Return duration and result of one invocation."""
+    t0 = time.perf_counter()
+    rects = func(page, graphics=graphics)
+    return time.perf_counter() - t0, rects
+
+
+parser = argparse.ArgumentParser(description="benchmark detect_graphics.detect_rects")
+parser.add_argument("-sizes", default="1000,10000,100000", help="numbers of paths")
+parser.add_argument("-reference", help="other detect_graphics version to compare with")
+parser.add_argument(
+    "-reference-limit",
+    type=int,
+    default=10000,
+    help="run reference up to this size (default 10000)",
+)
+args = parser.parse_args()
+
+ref = load_reference(args.reference) if args.reference else None
+for size in [int(s) for s in args.sizes.split(",")]:
+    doc, page, graphics = make_graphics_page(size)
+    t_new, rects = run(detect_graphics.detect_rects, page, graphics)
+    line = "%7i paths, %5i rects: %8.3f sec" % (len(graphics), len(rects), t_new)
+    if ref is not None and size <= args.reference_limit:
+        t_ref, ref_rects = run(ref.detect_rects, page, graphics)
+        if ref_rects != rects:
+            raise ValueError("rects differ from '%s'" % os.path.basename(args.reference))
+        line += ", reference %8.3f sec, speedup %.1f" % (t_ref, t_ref / t_new)
+    print(line)
@@ -7,13 +7,27 @@ This potentially results in a smaller set of rectangles, which each cover
 a vector graphics figure.
 
 The main function, "detect_rects", can be imported and invoked with a fitz.Page
-as the only argument. Any document type is supported.
+as the only argument. Any document type is supported. Already extracted
+drawings can be passed in via "graphics", or a PageAnalysis object (see
+page_analysis.py) via "analysis" to share them with other utilities.
 It returns a list of joined rectangles - which for instance can be used as the
 "clip" parameter of a Pixmap.
 
-It can be invoked standalone via "python detect_graphics.py input.pdf".
-In that case, it iterates over the documents pages and outputs a PNG for each
-encountered rectangles.
+It can be invoked standalone via "python detect_graphics.py input.pdf ...".
+In that case, it iterates over the documents' pages and outputs a PNG for each
+encountered rectangle, named "graphic-ppp-nn.png" (page and rectangle number).
+With more than one document, the file names start with the document's name.
+
+Pages are distributed across a pool of worker processes. Each page is
+interpreted only once into a display list, from which all of its rectangles
+are rendered. PNG encoding (with Pillow if installed, otherwise with PyMuPDF)
+and file writing happen on a thread pool, while the next clip is rendered.
+A manifest file "manifest.json" in the output folder lists page, rectangle
+and file name of every PNG.
+
+Usage
+------
+python detect_graphics.py input.pdf [...] [-output dir] [-dpi 150] [-jobs n] [-threads n]
 
 License & Copyright
 -------------------
@@ -21,10 +35,22 @@ License AGPL 3.0
 Copyright (c) 2021-2024, Jorj McKie
 """
 
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import fitz
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from page_analysis import PageAnalysis
+from rect_merge import merge_rects
 
-def detect_rects(page, graphics=None):
+
+def detect_rects(page, graphics=None, analysis=None):
     """Detect and join rectangles of neighboring vector graphics."""
     delta = 3
 
@@ -62,11 +88,13 @@ def detect_rects(page, graphics=None):
     parea = page.rect + (-36, -36, 36, 36)
 
     if graphics is None:
-        graphics = page.get_drawings()
+        if analysis is None:
+            analysis = PageAnalysis(page)
+        graphics = analysis.drawings
     # exclude graphics not contained inside margins
     paths = [
         p
-        for p in page.get_drawings()
+        for p in graphics
         if parea.x0 <= p["rect"].x0 <= p["rect"].x1 <= parea.x1
         and parea.y0 <= p["rect"].y0 <= p["rect"].y1 <= parea.y1
     ]
@@ -74,38 +102,135 @@ def detect_rects(page, graphics=None):
     # list of all vector graphic rectangles
     prects = sorted([p["rect"] for p in paths], key=lambda r: (r.y1, r.x0))
 
-    new_rects = []  # the final list of the joined rectangles
+    def join(r, p):
+        """Join p in to r. Supports empty p, i.e. lines."""
+        return r | p.tl | p.br
 
     # -------------------------------------------------------------------------
     # The strategy is to identify and join all rects that are neighbors
     # -------------------------------------------------------------------------
-    while prects:  # the algorithm will empty this list
-        r = prects[0]  # first rectangle
-        repeat = True
-        while repeat:
-            repeat = False
-            for i in range(len(prects) - 1, 0, -1):  # back to front
-                if are_neighbors(prects[i], r):
-                    r |= prects[i].tl  # join in to first rect
-                    r |= prects[i].br
-                    del prects[i]  # delete this rect
-                    repeat = True
-
-        prects[0] = +r
-        # move first item over to result list
-        new_rects.append(prects.pop(0))
-        prects = sorted(list(set(prects)), key=lambda r: (r.y1, r.x0))
+    new_rects = merge_rects(prects, are_neighbors, join, margin=delta)
 
     new_rects = sorted(list(set(new_rects)), key=lambda r: (r.y1, r.x0))
     return [r for r in new_rects if r.width > 5 and r.height > 5]
 
 
+def write_png(filename, data, dpi):
+    """Write a PNG file. 'data' is PNG bytes or (mode, width, height, samples).
+
+    Runs in a thread: encoding raw samples uses Pillow only, which (unlike
+    MuPDF) may run in parallel to the rendering thread.
+    """
+    if isinstance(data, tuple):
+        mode, width, height, samples = data
+        img = Image.frombytes(mode, (width, height), samples)
+        img.save(filename, "PNG", dpi=(dpi, dpi))
+    else:
+        with open(filename, "wb") as f:
+            f.write(data)
+
+
+def export_graphics(filename, pages, outdir=".", dpi=150, threads=4, prefix="graphic"):
+    """Save the graphics of a shard of pages as PNG files.
+
+    Every page is interpreted once into a display list, which then renders the
+    clip of every rectangle found by detect_rects. Files are written by a pool
+    of 'threads' threads, with a limited number of images waiting.
+    Returns a list of manifest entries {"page", "rect", "file"}.
+    """
+    doc = fitz.open(filename)
+    matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    modes = {1: "L", 3: "RGB", 4: "RGBA"}
+    entries = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for pno in pages:
+            page = doc[pno]
+            rects = detect_rects(page)
+            if not rects:
+                continue
+            dl = page.get_displaylist()
+            for i, r in enumerate(rects):
+                pix = dl.get_pixmap(matrix=matrix, clip=r)
+                if Image is not None and pix.n in modes:
+                    data = (modes[pix.n], pix.width, pix.height, pix.samples)
+                else:  # encode here: MuPDF must not run in several threads
+                    pix.set_dpi(dpi, dpi)
+                    data = pix.tobytes("png")
+                name = "%s-%03i-%02i.png" % (prefix, pno, i)
+                pending.append(
+                    executor.submit(write_png, os.path.join(outdir, name), data, dpi)
+                )
+                entries.append({"page": pno, "rect": list(r), "file": name})
+                while len(pending) > threads * 4:  # limit memory for images
+                    pending.popleft().result()
+            del dl
+        for future in pending:  # report any write errors
+            future.result()
+    doc.close()
+    return entries
+
+
 if __name__ == "__main__":
-    import sys
-
-    doc = fitz.open(sys.argv[1])
-    for page in doc:
-        new_rects = detect_rects(page)
-        for i, r in enumerate(new_rects):
-            pix = page.get_pixmap(dpi=150, clip=r)
-            pix.save("graphic-%03i-%02i.png" % (page.number, i))
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="save vector graphics as PNG files")
+    parser.add_argument("input", nargs="+", help="documents")
+    parser.add_argument("-output", default=".", help="output folder")
+    parser.add_argument("-dpi", type=int, default=150, help="resolution")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-threads", type=int, default=4, help="writer threads per process")
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    # contiguous shards of pages, several per worker to balance uneven pages
+    shards = deque()
+    for filename in args.input:
+        doc = fitz.open(filename)
+        pages = list(range(doc.page_count))
+        doc.close()
+        if len(args.input) == 1:
+            prefix = "graphic"
+        else:  # avoid file name collisions
+            prefix = os.path.splitext(os.path.basename(filename))[0] + "-graphic"
+        size = max(1, min(len(pages) // (args.jobs * 4), 32))
+        for i in range(0, len(pages), size):
+            shards.append((filename, pages[i : i + size], prefix))
+
+    manifest = []
+
+    def collect(filename, entries):
+        for entry in entries:
+            if len(args.input) > 1:
+                entry = dict(document=filename, **entry)
+            manifest.append(entry)
+
+    if args.jobs <= 1:
+        for filename, pages, prefix in shards:
+            entries = export_graphics(
+                filename, pages, args.output, args.dpi, args.threads, prefix
+            )
+            collect(filename, entries)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = deque()  # (filename, future) in page sequence
+            while shards or futures:
+                while shards and len(futures) < args.jobs * 2:  # keep workers busy
+                    filename, pages, prefix = shards.popleft()
+                    future = executor.submit(
+                        export_graphics,
+                        filename,
+                        pages,
+                        args.output,
+                        args.dpi,
+                        args.threads,
+                        prefix,
+                    )
+                    futures.append((filename, future))
+                filename, future = futures.popleft()
+                collect(filename, future.result())
+
+    with open(os.path.join(args.output, "manifest.json"), "w") as f:
+        f.write("[\n%s\n]\n" % ",\n".join(json.dumps(e) for e in manifest))
+    print("%i graphics saved in '%s'" % (len(manifest), args.output))
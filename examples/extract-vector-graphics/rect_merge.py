@@ -0,0 +1,155 @@
+"""
+Join rectangles of vector graphics into groups of "neighbors".
+
+Utilities like 'clean_graphics()' (clean_graphics.py) and 'detect_rects()'
+(detect_graphics.py) consolidate path rectangles like this:
+
+Take the first rectangle r of the list (sorted by bottom, then left
+coordinate). Walk through the other rectangles from back to front and join
+every rectangle that is a neighbor of r into r - which thereby grows. Repeat
+this until no more neighbor is found. Then r is final, and the next group
+starts with the first remaining rectangle.
+
+Scanning all remaining rectangles after every change is cubic in the number
+of paths. Function 'merge_rects()' below delivers the same result, but only
+looks at rectangles located near r, using a grid index. Every rectangle is
+compared in the same sequence as in the loop described above, so even
+neighbor definitions that are not monotonic (a neighbor of r may not be a
+neighbor of an enlarged r) lead to identical groups.
+
+Identical copies of this file exist in folders "table-analysis" and
+"examples/extract-vector-graphics".
+"""
+import heapq
+import math
+
+
+class _Grid:
+    """Uniform grid of cells containing the numbers of rectangles."""
+
+    def __init__(self, boxes):
+        self.x0 = min(b[0] for b in boxes)
+        self.y0 = min(b[1] for b in boxes)
+        width = max(b[2] for b in boxes) - self.x0
+        height = max(b[3] for b in boxes) - self.y0
+        # about 4 rectangles per cell, but not too many cells
+        n = min(max(int(math.sqrt(len(boxes) / 4)), 1), 128)
+        self.cell = max(width, height, 1) / n
+        self.nx = max(1, math.ceil(width / self.cell))
+        self.ny = max(1, math.ceil(height / self.cell))
+        self.cells = [set() for _ in range(self.nx * self.ny)]
+        self.ranges = [self.cell_range(b, 0) for b in boxes]
+        for i, crange in enumerate(self.ranges):
+            for c in self.range_cells(crange):
+                c.add(i)
+
+    def cell_range(self, box, margin):
+        """Return (cx0, cy0, cx1, cy1) of the cells touched by box +/- margin."""
+        cell = self.cell
+        cx0 = min(max(int((box[0] - margin - self.x0) // cell), 0), self.nx - 1)
+        cy0 = min(max(int((box[1] - margin - self.y0) // cell), 0), self.ny - 1)
+        cx1 = min(max(int((box[2] + margin - self.x0) // cell), 0), self.nx - 1)
+        cy1 = min(max(int((box[3] + margin - self.y0) // cell), 0), self.ny - 1)
+        return cx0, cy0, cx1, cy1
+
+    def range_cells(self, crange, old=None):
+        """Yield the cells of a cell range, skipping those of range 'old'."""
+        cx0, cy0, cx1, cy1 = crange
+        for cy in range(cy0, cy1 + 1):
+            row = cy * self.nx
+            if old is not None and old[1] <= cy <= old[3]:
+                # skip the part of this row already covered by 'old'
+                for cx in range(cx0, cx1 + 1):
+                    if not old[0] <= cx <= old[2]:
+                        yield self.cells[row + cx]
+                continue
+            for cx in range(cx0, cx1 + 1):
+                yield self.cells[row + cx]
+
+    def remove(self, i):
+        """Remove rectangle number i from the grid."""
+        for c in self.range_cells(self.ranges[i]):
+            c.discard(i)
+
+
+def merge_rects(rects, are_neighbors, join, margin=0):
+    """Join neighboring rectangles.
+
+    Args:
+        rects: (list) rectangles, sorted by the desired sequence of groups
+        are_neighbors: (callable) are_neighbors(p, r) is True if rectangle p
+            must be joined into the growing rectangle r
+        join: (callable) join(r, p) returns r enlarged by p
+        margin: (float) are_neighbors(p, r) can only be True if p touches
+            r enlarged by this value in every direction
+    Returns:
+        List of the joined rectangles in the sequence of their completion.
+        Like the loops replaced by this function, duplicate rectangles are
+        removed after completion of the first group.
+    """
+    n = len(rects)
+    if n == 0:
+        return []
+    boxes = [tuple(r) for r in rects]
+    grid = _Grid(boxes)
+    margin += 1  # safety distance against rounding effects
+    remaining = set(range(n))
+    seeds = list(range(n))  # rectangle numbers, already in sequence
+    heapq.heapify(seeds)
+    new_rects = []
+
+    while remaining:
+        seed = heapq.heappop(seeds)
+        if seed not in remaining:
+            continue
+        remaining.discard(seed)
+        grid.remove(seed)
+        r = rects[seed]
+
+        repeat = True
+        while repeat:  # one iteration is one walk from back to front
+            repeat = False
+            pos = n  # only rectangles before this position are pending
+            seen = set()
+            pending = []  # max-heap of rectangle numbers near r
+            crange = None  # cells inspected so far
+
+            def collect(r, crange):
+                """Add rectangles near r which have not yet been collected."""
+                new_range = grid.cell_range(tuple(r), margin)
+                if crange is not None:  # r has grown: add the new cells only
+                    new_range = (
+                        min(new_range[0], crange[0]),
+                        min(new_range[1], crange[1]),
+                        max(new_range[2], crange[2]),
+                        max(new_range[3], crange[3]),
+                    )
+                for c in grid.range_cells(new_range, crange):
+                    for i in c:
+                        if i < pos and i not in seen:
+                            seen.add(i)
+                            heapq.heappush(pending, -i)
+                return new_range
+
+            crange = collect(r, crange)
+            while pending:
+                i = -heapq.heappop(pending)
+                pos = i
+                if are_neighbors(rects[i], r):
+                    r = join(r, rects[i])
+                    remaining.discard(i)
+                    grid.remove(i)
+                    repeat = True
+                    crange = collect(r, crange)
+
+        new_rects.append(r)
+        if len(new_rects) == 1:  # remove duplicates from the remaining rects
+            unique = set()
+            for i in sorted(remaining):
+                if boxes[i] in unique:
+                    remaining.discard(i)
+                    grid.remove(i)
+                else:
+                    unique.add(boxes[i])
+
+    return new_rects
@@ -0,0 +1,296 @@
+"""
+Batch rendering of invoices
+---------------------------
+Script 'invoicer.py' creates one invoice. Creating many invoices like this
+repeats the same work for each of them: reading the HTML sources, resolving
+the report fonts, creating the page header building blocks - and, if every
+invoice is made by a new process, importing PyMuPDF.
+
+Class InvoiceTemplate separates the invoice template from the invoice data.
+A template is "compiled" once: HTML sources, report CSS (including fonts
+given via 'font_families'), the archive and the page header blocks. Its
+method 'render()' then creates the report for one invoice number.
+
+Function 'render_batch()' distributes invoice numbers over a pool of worker
+processes. Every worker compiles the template once when it starts and uses
+it for all invoices it renders. Output is one PDF per invoice, or one
+combined PDF with a bookmark per invoice.
+
+The sample database contains the items of a single invoice, which are used
+for every invoice number.
+
+Usage
+------
+python invoice_batch.py [-count 100] [-jobs n] [-output folder] [-combined file.pdf] [-single-pass]
+
+or from Python:
+
+from invoice_batch import render_batch
+render_batch(range(1, 1001), output="invoices")
+"""
+import collections
+import io
+import os
+import pathlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from Reports import *
+
+# Following data would normally be extracted from a data base.
+SUPPLIER = """Artifex Software, Inc.
+39 Mesa Street
+Suite 108A
+San Francisco, CA 94129
+UNITED STATES
+"""
+
+SHIPTO = """Paul Atreides (Muad'Dib)
+The Emperor's Palace
+Arrakeen
+Planet Arrakis (Dune)
+"""
+
+BILLTO = """Jorj X. McKie, Saboteur Extraordinary
+Bureau of Sabotage
+Central City
+Planet Central-Central
+"""
+
+
+class InvoiceTemplate:
+    """The parts of the invoice report which are the same for all invoices."""
+
+    def __init__(self, folder=".", font_families=None, single_pass=False):
+        folder = pathlib.Path(folder)
+        self.mediabox = fitz.paper_rect("a4-l")
+        self.single_pass = single_pass  # see Report.run
+
+        # resolve CSS and fonts once, using a report for this purpose only
+        report = Report(
+            self.mediabox, archive=fitz.Archive(str(folder)), font_families=font_families
+        )
+        self.css = report.css
+        self.archive = report.archive
+
+        self.prolog_html = (folder / "prolog.html").read_bytes().decode()
+        self.items_html = (folder / "items.html").read_bytes().decode()
+        hdr_html = (folder / "header.html").read_bytes().decode()
+        header = Block(html=hdr_html, report=report)
+        logo = ImageBlock(url="logo.png", height=80, report=report, archive=self.archive)
+        self.header = [logo, header]  # shared by all invoice reports
+
+        self.database = sqlite3.connect(str(folder / "invoice-parms.db"))
+
+    def fetch_invoice(self, number):
+        """Return addresses and item rows of an invoice."""
+        cursor = self.database.cursor()
+
+        # Extract invoice items
+        # Note that the last items is computed by SQL!
+        select = (
+            'select line, "hp-id", desc, part,qty, uom,date,'
+            "uprice, qty*uprice"
+            ' from "invoice-items" order by line'
+        )
+        cursor.execute(select)  # read the invoice items into a list
+        rows = cursor.fetchall()
+
+        # we need some modifications for the report:
+        field_count = len(rows[0])  # number of fields
+        total = 0  # total price of the invoice
+        for i in range(len(rows)):  # walk through the rows
+            row = list(rows[i])  # make sure to have a modifiable list
+            uprice, tprice = row[-2:]  # read the prices
+            total += tprice  # add to the total prices
+            # modify items to show the currency
+            row[-1] = f"${tprice}"
+            row[-2] = f"${uprice}"
+            rows[i] = row  # update the rows list
+
+        # add a final row with the invoice total
+        total_row = [""] * field_count
+        total_row[-2] = "Total:"
+        total_row[-1] = f"${round(total,2)}"
+        rows.append(total_row)
+
+        # prepend a row with the HTML field id's:
+        fields = ["line", "hp-id", "desc", "part", "qty", "uom", "date", "uprice", "tprice"]
+        rows.insert(0, fields)
+        addresses = {
+            "supplier": SUPPLIER,
+            "contact": SUPPLIER,
+            "shipto": SHIPTO,
+            "billto": BILLTO,
+        }
+        return addresses, rows
+
+    def render(self, number, output):
+        """Write the invoice to output, a file name or file object."""
+        addresses, rows = self.fetch_invoice(number)
+        report = Report(self.mediabox, css=self.css, archive=self.archive)
+
+        # fill in the variables of the prolog skeleton
+        prolog_story = fitz.Story(self.prolog_html)
+        body = prolog_story.body
+        for key, text in addresses.items():
+            body.find(None, "id", key).add_text(text)
+        prolog = Block(story=prolog_story, report=report)
+
+        items = Table(
+            html=self.items_html,
+            fetch_rows=lambda: rows,
+            top_row="header",
+            report=report,
+            last_row_bg="#ff0",
+        )
+
+        report.header = self.header
+        report.sections = [
+            [prolog, Options(cols=1, format="letter-l")],
+            [items, Options(format=Size(600, 600), newpage=False)],
+        ]
+        report.reset_sections()  # header blocks may come from a previous report
+        report.run(output, single_pass=self.single_pass)
+
+
+template = None  # the InvoiceTemplate of a worker process
+
+
+def init_worker(folder, font_families, single_pass):
+    """Compile the template once per worker process."""
+    global template
+    template = InvoiceTemplate(folder, font_families, single_pass)
+
+
+def render_files(numbers, filenames):
+    """Render invoices to files."""
+    for number, filename in zip(numbers, filenames):
+        template.render(number, filename)
+    return len(numbers)
+
+
+def render_bytes(numbers):
+    """Render invoices to memory and return a list of PDF bytes."""
+    pdfs = []
+    for number in numbers:
+        fp = io.BytesIO()
+        template.render(number, fp)
+        pdfs.append(fp.getvalue())
+    return pdfs
+
+
+def render_batch(
+    numbers,
+    output=".",
+    combined=None,
+    jobs=None,
+    folder=".",
+    font_families=None,
+    single_pass=False,
+    chunk=16,
+):
+    """Render the invoices with the given numbers.
+
+    Args:
+        numbers: (iterable) invoice numbers
+        output: (str) folder for the files 'invoice-<number>.pdf'
+        combined: (str) if given, write a single PDF with this name instead,
+            with a bookmark "Invoice <number>" for every invoice
+        jobs: (int) worker processes, default os.cpu_count(). With 1, all is
+            done in this process.
+        folder: (str) folder containing HTML sources, logo and database
+        font_families, single_pass: see Report and Report.run
+        chunk: (int) number of invoices per task of a worker
+    Returns:
+        The number of invoices.
+    """
+    jobs = jobs or os.cpu_count()
+    initargs = (folder, font_families, single_pass)
+    if combined is None:
+        os.makedirs(output, exist_ok=True)
+        doc = None
+    else:
+        doc = fitz.open()
+        toc = []
+
+    def tasks():
+        """Yield the chunks of invoice numbers."""
+        numbers_iter = iter(numbers)
+        while True:
+            numbers_chunk = [n for _, n in zip(range(chunk), numbers_iter)]
+            if not numbers_chunk:
+                return
+            yield numbers_chunk
+
+    def task(numbers_chunk):
+        """Return function and arguments rendering a chunk of invoices."""
+        if doc is not None:
+            return render_bytes, (numbers_chunk,)
+        filenames = [os.path.join(output, f"invoice-{n}.pdf") for n in numbers_chunk]
+        return render_files, (numbers_chunk, filenames)
+
+    def collect(numbers_chunk, result):
+        """Append rendered invoices to the combined PDF."""
+        if doc is None:
+            return
+        for number, pdf in zip(numbers_chunk, result):
+            src = fitz.open("pdf", pdf)
+            toc.append([1, f"Invoice {number}", doc.page_count + 1])
+            doc.insert_pdf(src)
+            src.close()
+
+    count = 0
+    if jobs <= 1:
+        init_worker(*initargs)
+        for numbers_chunk in tasks():
+            func, func_args = task(numbers_chunk)
+            collect(numbers_chunk, func(*func_args))
+            count += len(numbers_chunk)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_worker, initargs=initargs
+        ) as executor:
+            pending = collections.deque()  # bounded: results are kept in order
+            for numbers_chunk in tasks():
+                func, func_args = task(numbers_chunk)
+                pending.append((numbers_chunk, executor.submit(func, *func_args)))
+                if len(pending) >= 2 * jobs:
+                    numbers_chunk, future = pending.popleft()
+                    collect(numbers_chunk, future.result())
+                    count += len(numbers_chunk)
+            while pending:
+                numbers_chunk, future = pending.popleft()
+                collect(numbers_chunk, future.result())
+                count += len(numbers_chunk)
+
+    if doc is not None:
+        doc.set_toc(toc)
+        doc.ez_save(combined)
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="render many invoices")
+    parser.add_argument("-count", type=int, default=100, help="number of invoices")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-output", default="invoices", help="folder for invoice files")
+    parser.add_argument("-combined", help="write one PDF with this name instead")
+    parser.add_argument("-single-pass", action="store_true", help="see Report.run")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    count = render_batch(
+        range(1, args.count + 1),
+        output=args.output,
+        combined=args.combined,
+        jobs=args.jobs,
+        single_pass=args.single_pass,
+    )
+    duration = time.perf_counter() - t0
+    print("%i invoices in %.1f sec, %.1f per second" % (count, duration, count / duration))
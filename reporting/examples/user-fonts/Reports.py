@@ -1,6 +1,7 @@
 # written by Green
 
 import io
+import itertools
 import fitz
 import sys
 from pprint import pprint
@@ -86,6 +87,7 @@ class Table:
         archive=None,
         css=None,
         alternating_bg=None,
+        chunk_rows=None,
     ):
         self.report = report
         self.html = html
@@ -110,12 +112,32 @@ class Table:
         self.HEADER_FONT = None
         self.HEADER_PATHS = None
         self.header_tops = []  # list where.y0 coordinates
+        self.header_cache = {}  # top row extractions by layout
         self.reset = False  # this building must not be reset
         self.alternating_bg = alternating_bg
         self.last_row_bg = last_row_bg
+        self.chunk_rows = chunk_rows  # if set, stream rows in chunks of this size
+        self.header_story = None  # (width, story, offset, height) of top row
 
     def extract_header(self, story):
-        """Extract top row from table for later reproduction."""
+        """Extract top row from table for later reproduction.
+
+        'story' is the table Story, or a function returning it. The result
+        depends on the table and the layout rectangle only. So it is cached,
+        and the story is needed only if the layout is new.
+        """
+        key = (self.html, self.css, self.report.cols, tuple(self.report.where))
+        if key not in self.header_cache:
+            if callable(story):
+                story = story()
+            self.header_cache[key] = self.layout_header(story)
+        rects, self.HEADER_BLOCKS, self.HEADER_PATHS, self.HEADER_FONT = (
+            self.header_cache[key]
+        )
+        self.HEADER_RECTS = list(rects)
+
+    def layout_header(self, story):
+        """Return rectangles, text blocks, paths and font of the top row."""
 
         def recorder(pos):
             """small recorder function for determining the top row rectangle."""
@@ -129,6 +151,7 @@ class Table:
             self.HEADER_RECT = fitz.Rect(pos.rect)  # found:store header rect
 
         # write first occurrence of table to find header information
+        rects = []
         fp = io.BytesIO()  # for memory PDF
         writer = fitz.DocumentWriter(fp)
         story.reset()
@@ -149,7 +172,7 @@ class Table:
             story.element_positions(
                 recorder, {"page": 0, "header": self.top_row}
             )  # get rectangle of top row
-            self.HEADER_RECTS.append(self.HEADER_RECT)
+            rects.append(self.HEADER_RECT)
 
         if (
             self.HEADER_LAST_COL_RECT != None
@@ -157,6 +180,9 @@ class Table:
         ):  # check last column is over top row
             raise ValueError("Not enough to place it in {0} columns".format(columns))
 
+        # only draw what is needed: the story down to the top row
+        story.reset()
+        story.place(fitz.Rect(CELL.x0, CELL.y0, CELL.x1, self.HEADER_RECT.y1 + 1))
         story.draw(dev)
         writer.end_page()
         writer.close()
@@ -170,18 +196,61 @@ class Table:
         blocks = page.get_text(
             "dict", clip=self.HEADER_RECT, flags=fitz.TEXTFLAGS_TEXT
         )["blocks"]
-        if blocks:  # extract the font name for text in the header
-            self.HEADER_FONT = page.get_fonts()[0][3]
+        font = page.get_fonts()[0][3] if blocks else None  # font of header text
         doc.close()
         story.reset()
-        # self.HEADER_RECTS = +self.HEADER_RECT
-        self.HEADER_RECTS.reverse()
+        rects.reverse()
         self.HEADER_RECT = None
-        self.HEADER_BLOCKS = blocks
-        self.HEADER_PATHS = paths
-        return
+        return rects, blocks, paths, font
+
+    def make_row(self, templ, fields, data, j, last, widths=None):
+        """Make table row number j from the template row.
+
+        'widths' optionally maps field ids to the width of their cells.
+        """
+        row = templ.clone()  # clone model row
+        if self.alternating_bg != None and len(self.alternating_bg) >= 2:
+            bg_color = self.alternating_bg[j % len(self.alternating_bg)]
+            row.set_properties(bgcolor=bg_color)
+        else:
+            bg_color = "#fff"  # ensure there always is a background color
+        if self.last_row_bg and last:
+            bg_color = self.last_row_bg
+        for i in range(len(data)):
+            text = str(data[i]).replace("\\n", "\n").replace("<br>", "\n")
+            tag = row.find(None, "id", fields[i])
+            if tag is None:
+                raise ValueError(f"id '{fields[i]}' not in template row.")
+            if bg_color:
+                tag.set_properties(bgcolor=bg_color)
+            if widths and fields[i] in widths:
+                # a little extra room against rounding: text must not wrap
+                tag.add_style("width:%.2fpx" % (widths[fields[i]] + 0.01))
+            if text.startswith("|img|"):
+                _ = tag.add_image(text[5:])
+            else:
+                _ = tag.add_text(text)
+        return row
 
     def make_story(self):
+        if self.chunk_rows:  # rows are streamed
+            if not isinstance(self.story, TableStream):
+                self.story = TableStream(self)
+            if self.top_row is not None:
+                self.extract_header(story=self.story.first_story)
+            return
+
+        if not isinstance(self.story, fitz.Story):
+            self.story = self.build_story()
+            story = self.story
+        else:  # only build a new story if the top row must be extracted
+            story = self.build_story
+
+        if self.top_row != None:
+            self.extract_header(story=story)
+
+    def build_story(self):
+        """Make a new Story of the table containing all rows."""
         story = fitz.Story(self.html, user_css=self.css, archive=self.archive)
         body = story.body
         table = body.find("table", None, None)
@@ -213,75 +282,248 @@ class Table:
         rows = rows[1:]  # row data
 
         for j, data in enumerate(rows):
-            row = templ.clone()  # clone model row
-            if self.alternating_bg != None and len(self.alternating_bg) >= 2:
-                bg_color = self.alternating_bg[j % len(self.alternating_bg)]
-                row.set_properties(bgcolor=bg_color)
-            else:
-                bg_color = "#fff"  # ensure there always is a background color
-            if self.last_row_bg and j == len(rows) - 1:
-                bg_color = self.last_row_bg
-            for i in range(len(data)):
-                text = str(data[i]).replace("\\n", "\n").replace("<br>", "\n")
-                tag = row.find(None, "id", fields[i])
-                if tag is None:
-                    raise ValueError(f"id '{fields[i]}' not in template row.")
-                if bg_color:
-                    tag.set_properties(bgcolor=bg_color)
-                if text.startswith("|img|"):
-                    _ = tag.add_image(text[5:])
-                else:
-                    _ = tag.add_text(text)
+            row = self.make_row(templ, fields, data, j, j == len(rows) - 1)
             table.append_child(row)
 
         if templ:
             templ.remove()
+        return story
+
+    def draw_header(self, device, cell, top):
+        """Draw the top row on a device, in cell at y-coordinate top.
+
+        Used instead of 'repeat_header' if the report is written in a single
+        pass: a copy of the table without the content preceding the top row
+        is positioned such that only the top row falls into the cell.
+        """
+        if self.header_story is None or self.header_story[0] != cell.width:
+            if isinstance(self.story, TableStream):
+                story = self.story.first_story()
+            else:
+                story = self.build_story()
+            node = story.body.find(None, "id", self.top_row)
+            if node is None:
+                raise ValueError(f"cannot find top row '{self.top_row}'")
+            while node.tagname != "body":  # remove everything before top row
+                while node.previous is not None:
+                    node.previous.remove()
+                node = node.parent
+            rects = []
+
+            def recorder(pos):
+                if pos.open_close & 2 and pos.id == self.top_row:
+                    rects.append(fitz.Rect(pos.rect))
+
+            story.place(fitz.Rect(cell.x0, 0, cell.x1, cell.height))
+            story.element_positions(recorder)
+            if rects == []:
+                raise ValueError(f"top row '{self.top_row}' does not fit")
+            self.header_story = (cell.width, story, rects[0].y0, rects[0].height)
+
+        _, story, offset, height = self.header_story
+        story.reset()
+        story.place(fitz.Rect(cell.x0, top - offset, cell.x1, top + height + 1))
+        story.draw(device)
 
-        if not isinstance(self.story, fitz.Story):
-            self.story = story
-
-        if self.top_row != None:
-            self.extract_header(story=story)
-
-    def repeat_header(self, page, rect, font_dict):
-        """Recreate the top row header of the table on given page, rectangle"""
-
-        def make_fontname(page, font, font_dict):
-            xref, refname, pno = font_dict[font]
-            if pno == page.number:
-                return refname
-            font_items = page.get_fonts()
-            refnames = [item[4] for item in font_items if item[3] == font]
-            if refnames != []:
-                return refnames[0]
-            refnames = [item[4] for item in font_items]
-            i = 1
-            fontname = "F1"
-            while fontname in refnames:
-                i += 1
-                fontname = f"F{i}"
-            font_ex = page.parent.extract_font(xref)
-            font_buff = font_ex[-1]
-            page.insert_font(fontname=fontname, fontbuffer=font_buff)
-            return fontname
+    def repeat_header(self, page, rect, fonts):
+        """Recreate the top row header of the table on given page, rectangle.
 
+        'fonts' is the FontRegistry of the document.
+        """
         mat = self.HEADER_RECTS[0].torect(rect)
+        shape = page.new_shape()  # page contents are only updated once
 
         for p in self.HEADER_PATHS:
             for item in p["items"]:
                 if item[0] == "l":
-                    page.draw_line(item[1] * mat, item[2] * mat, color=p["color"])
+                    shape.draw_line(item[1] * mat, item[2] * mat)
+                    shape.finish(color=p["color"], closePath=False)
                 elif item[0] == "re":
-                    page.draw_rect(item[1] * mat, color=p["color"], fill=p["fill"])
+                    shape.draw_rect(item[1] * mat)
+                    shape.finish(color=p["color"], fill=p["fill"])
 
-        fontname = make_fontname(page, self.HEADER_FONT, font_dict)
+        if self.HEADER_BLOCKS:
+            fontname = fonts.fontname(page, self.HEADER_FONT)
         for block in self.HEADER_BLOCKS:
             for line in block["lines"]:
                 for span in line["spans"]:
                     point = fitz.Point(span["origin"]) * mat
-                    page.insert_text(
+                    shape.insert_text(
                         point, span["text"], fontname=fontname, fontsize=span["size"]
                     )
+        shape.commit()
+
+
+class TableStream:
+    """Lay out the rows of a Table in chunks, like a single Story would.
+
+    Rows are pulled lazily from 'fetch_rows', 'chunk_rows' at a time. Every
+    chunk is a separate Story containing a copy of the table with just these
+    rows. It is released once it has been drawn, so memory does not depend
+    on the number of rows.
+    Only the first chunk contains what precedes the template row (e.g. the
+    top row), only the last chunk what follows the table. Cells of all other
+    chunks get the widths of the first chunk's cells to keep columns aligned.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        rows = table.fetch_rows() if callable(table.fetch_rows) else table.fetch_rows
+        self.rows = iter(rows)
+        self.fields = next(self.rows, None)  # first row contains the field ids
+        if self.fields is None:
+            raise ValueError("'fetch_rows' delivered no rows")
+        self.widths = None  # cell widths of the first chunk
+        self.placed = []  # stories placed but not yet drawn
+
+        self.first_rows = list(itertools.islice(self.rows, table.chunk_rows))
+        self.pending = list(itertools.islice(self.rows, table.chunk_rows))
+        self.single = self.pending == []  # the first chunk is the only one
+        self.story = self.first_story()  # the chunk currently laid out
+        self.count = len(self.first_rows)  # rows in chunks made so far
+
+    def make_chunk(self, rows, start, first, last):
+        """Make the Story of a chunk of rows, the first having number start."""
+        t = self.table
+        story = fitz.Story(t.html, user_css=t.css, archive=t.archive)
+        table = story.body.find("table", None, None)
+        templ = story.body.find(None, "id", "template")  # locate template row
+        if table is None or templ is None:
+            raise ValueError("cannot find table with row 'template'")
+
+        # remove everything not belonging to this chunk
+        node = templ
+        inside = True  # siblings of node are parts of the table
+        while node.tagname != "body":
+            if node.tagname == "table":
+                inside = False
+            if not first:
+                while node.previous is not None:
+                    node.previous.remove()
+            if not first and inside or not last and not inside:
+                while node.next is not None:
+                    node.next.remove()
+            node = node.parent
+        # no body margins between chunks
+        if not first:
+            story.body.add_style("margin-top:0")
+        if not last:
+            story.body.add_style("margin-bottom:0")
+
+        widths = None if first else self.widths
+        for j, data in enumerate(rows, start):
+            is_last = last and j == start + len(rows) - 1
+            table.append_child(t.make_row(templ, self.fields, data, j, is_last, widths))
+        templ.remove()
+        return story
+
+    def first_story(self):
+        """Make a new Story of the first chunk."""
+        return self.make_chunk(self.first_rows, 0, True, self.single)
+
+    def next_story(self):
+        """Make the Story of the next chunk. Return None if there is none."""
+        if not self.pending:
+            return None
+        rows = self.pending
+        self.pending = list(itertools.islice(self.rows, self.table.chunk_rows))
+        story = self.make_chunk(rows, self.count, False, self.pending == [])
+        self.count += len(rows)
+        return story
+
+    def measure_widths(self, where):
+        """Return the widths of the cells in the first row of the first chunk."""
+        fields = set(map(str, self.fields))
+        widths = {}
+
+        def recorder(pos):
+            if pos.open_close & 1 and pos.id in fields and pos.id not in widths:
+                widths[pos.id] = pos.rect[2] - pos.rect[0]
+
+        story = self.first_story()
+        more = True
+        while more and len(widths) < len(fields):
+            more, _ = story.place(where)
+            story.element_positions(recorder)
+        return widths
+
+    def place(self, where):
+        """Place the next part of the table rows in where, like Story.place."""
+        if self.widths is None:  # measure when the layout width is known
+            self.widths = self.measure_widths(where)
+        rect = fitz.Rect(where)
+        filled = fitz.Rect()
+        while True:
+            more, used = self.story.place(rect)
+            self.placed.append(self.story)
+            used = fitz.Rect(used)
+            if not used.is_empty:
+                filled = used if filled.is_empty else filled | used
+            if more:
+                return more, filled
+            story = self.next_story()
+            if story is None:  # all rows are placed
+                return more, filled
+            self.story = story  # continue with the next chunk below
+            rect.y0 = max(rect.y0, used.y1)
+            if rect.is_empty:
+                return 1, filled
+
+    def draw(self, device, matrix=None):
+        """Draw what was placed last, then release completed chunks."""
+        for story in self.placed:
+            story.draw(device, matrix)
+        self.placed = []
+
+
+class FontRegistry:
+    """Document-wide registry of the fonts needed by repeated top rows.
+
+    A page showing a top row may not use its font yet. Instead of embedding
+    another copy of the font, the page then refers to the font object which
+    the document already contains. Pages are only searched for a font until
+    it has been found.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.xrefs = {}  # font name -> xref
+        self.pno = 0  # number of pages searched for fonts
+
+    def xref(self, font):
+        """Return the xref of a font of the document."""
+        while font not in self.xrefs and self.pno < self.doc.page_count:
+            for item in self.doc[self.pno].get_fonts():
+                self.xrefs.setdefault(item[3], item[0])
+            self.pno += 1
+        if font not in self.xrefs:
+            raise ValueError(f"font '{font}' not in document")
+        return self.xrefs[font]
+
+    def fontname(self, page, font):
+        """Return the reference name of font on page, adding it if needed."""
+        font_items = page.get_fonts()
+        refnames = [item[4] for item in font_items if item[3] == font]
+        if refnames != []:
+            return refnames[0]
+        refnames = [item[4] for item in font_items]
+        i = 1
+        fontname = "F1"
+        while fontname in refnames:
+            i += 1
+            fontname = f"F{i}"
+
+        # add the font to the page's /Resources/Font dictionary, following
+        # indirect objects, which xref_set_key does not do
+        xref, path = page.xref, "Resources"
+        for key in ("Font", fontname):
+            kind, value = self.doc.xref_get_key(xref, path)
+            if kind == "xref":
+                xref, path = int(value.split()[0]), key
+            else:
+                path += "/" + key
+        self.doc.xref_set_key(xref, path, f"{self.xref(font)} 0 R")
+        return fontname
 
 
 class Report:
@@ -421,7 +663,12 @@ class Report:
         CELLS = [TABLE[i][j] for i in range(rows) for j in range(columns)]
         return CELLS
 
-    def run(self, filename):
+    def layout(self, writer, page_count=None):
+        """Lay out all sections on pages of writer and return the page count.
+
+        If writer is None, nothing is drawn. If page_count is given, page
+        numbers and repeated table top rows are drawn as well.
+        """
         # init
         if self.header is None:  # set empty list
             self.header = []
@@ -445,9 +692,6 @@ class Report:
         pno = 0  #
         self.mediabox = self.get_pagerect()  # init
 
-        fileobject = io.BytesIO()  # let DocumentWriter write to memory
-        writer = fitz.DocumentWriter(fileobject)  # define output writer
-
         if len(self.header):
             for hElement in self.header:
                 _, self.header_rect = hElement.story.place(self.where)
@@ -467,7 +711,9 @@ class Report:
         _ = self.check_cols()  # set initial columns from first section
 
         while more:  # loop until all input text has been written out
-            dev = writer.begin_page(self.mediabox)  # prepare a new output page
+            page_rect = self.mediabox
+            # without writer, stories are drawn to no device
+            dev = writer.begin_page(page_rect) if writer else None
 
             self.where = self.set_margin(self.mediabox)  # set margin
             self.where.y0 = (  # remove space of header from main area
@@ -526,6 +772,8 @@ class Report:
                     if (
                         len(self.current_story().header_tops) > 1
                     ):  # skip first piece of table because that already has a top row
+                        if page_count and dev:  # draw top row now
+                            self.current_story().draw_header(dev, where, where.y0)
                         where.y0 += (
                             self.current_story().HEADER_RECTS[cell_index].height
                         )  # move beginning of table as much as top row height
@@ -596,24 +844,78 @@ class Report:
                     fElement.story.place(self.footer_rect)
                     fElement.story.draw(dev, None)
 
-            writer.end_page()  # finish one page
+            if page_count and dev:  # draw page number
+                btm_rect = fitz.Rect(
+                    self.where.x0, page_rect.y1 - 30, page_rect.x1, page_rect.y1
+                )
+                self.draw_page_number(dev, btm_rect, pno, page_count)
+
+            if writer:
+                writer.end_page()  # finish one page
 
             if self.is_over():  # end writing
                 break
             pno += 1
+        return pno + 1
+
+    def reset_sections(self):  # restart layout of all stories
+        self.sindex = 0
+        for element in self.header + self.footer + self.sections:
+            if isinstance(element, (list, tuple)):
+                element = element[0]
+            if isinstance(element.story, fitz.Story):
+                element.story.reset()
+            elif isinstance(element.story, TableStream):
+                element.story = None  # rows are fetched again
+            if hasattr(element, "header_tops"):
+                element.header_tops = []  # top row geometry is kept
+
+    def draw_page_number(self, dev, rect, pno, page_count):
+        story = fitz.Story(
+            "<p>Page {0} of {1}</p>".format(pno + 1, page_count),
+            user_css="body {margin: 0} p {margin: 0; font-family: sans-serif; "
+            "font-size: 11px; line-height: 1.55; text-align: center}",
+        )
+        story.place(rect)
+        story.draw(dev)
+
+    def run(self, filename, single_pass=False):
+        """Write the report to a PDF file.
+
+        By default, pages are written to memory first. Page numbers and
+        repeated table top rows are added when all pages are known, and fonts
+        are subset before saving.
+        With single_pass=True, a dry run of the layout - drawing to no device -
+        determines the page count. Then every page is written directly to the
+        file, complete with page number and top rows. Fonts are not subset.
+        """
+        if single_pass:
+            for section in self.sections:
+                story = section[0] if isinstance(section, (list, tuple)) else section
+                if hasattr(getattr(story, "fetch_rows", None), "__next__"):
+                    raise ValueError("single_pass cannot read 'fetch_rows' twice")
+            where = fitz.Rect(self.where)
+            page_count = self.layout(None)
+            self.where = where
+            self.reset_sections()
+            writer = fitz.DocumentWriter(filename, "compress")
+            if self.layout(writer, page_count) != page_count:
+                raise ValueError("page count changed after dry run")
+            writer.close()
+            return
+
+        fileobject = io.BytesIO()  # let DocumentWriter write to memory
+        writer = fitz.DocumentWriter(fileobject)  # define output writer
+        self.layout(writer)
         writer.close()
 
         doc = fitz.open("pdf", fileobject)
         page_count = doc.page_count  # page count
-        font_dict = dict()
+        fonts = FontRegistry(doc)
 
         for page in doc:  # draw footer with page number
             page.wrap_contents()
 
-            for item in page.get_fonts():
-                xref, _, _, fontname, refname, _ = item
-                font_dict[fontname] = (xref, refname, page.number)
-
             btm_rect = fitz.Rect(
                 self.where.x0, page.rect.y1 - 30, page.rect.x1, page.rect.y1
             )
@@ -651,7 +953,7 @@ class Report:
                     self.current_story().repeat_header(
                         page,
                         fitz.Rect(header["left"], header["top"], x1, y1),
-                        font_dict,
+                        fonts,
                     )
 
         doc.subset_fonts()
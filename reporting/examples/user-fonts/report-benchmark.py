@@ -0,0 +1,117 @@
+"""
+Utility
+--------
+Measure size and generation time of reports with many pages, each of which
+repeats the top row of a long table.
+
+The table uses the DejaVu Sans Condensed fonts of this folder. Only the top
+row is bold, so the bold font must be made available to every page showing a
+repeated top row.
+
+Optionally, a reference version of 'Reports.py' is measured as well -
+typically a previous one, e.g. obtained via
+
+git show <revision>:reporting/examples/user-fonts/Reports.py > Reports_ref.py
+
+Both versions must deliver the same number of pages. Option '-chunk-rows'
+is passed to the tested version only, so that references older than
+Table parameter 'chunk_rows' can be used.
+
+Usage
+------
+python report-benchmark.py [-rows 5000,20000,80000] [-chunk-rows 0] [-reference Reports_ref.py]
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+import fitz
+
+import Reports
+
+HTML = """
+<style>
+table {border-spacing: 0;}
+td,th {border: .2px solid #bbb;}
+td {padding-left: 3px;padding-right: 3px;}
+</style>
+<table>
+    <tr id="toprow" style="background-color: #ffff00">
+        <th>Number</th>
+        <th>Account</th>
+        <th>Amount</th>
+    </tr>
+    <tr id="template">
+        <td id="no"></td>
+        <td id="account"></td>
+        <td style="text-align: right;" id="amount"></td>
+    </tr>
+</table>
+"""
+
+css = '@font-face {font-family: myfont; src: url("DejaVuSansCondensed.ttf");} '
+css += '@font-face {font-family: myfont; src: url("DejaVuSansCondensed-Bold.ttf");font-weight:bold;} '
+css += "* {font-family: myfont;}"
+
+
+def load_reference(filename):
+    """Import another version of Reports from a file."""
+    spec = importlib.util.spec_from_file_location("Reports_ref", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_rows(count):
+    """Return field ids and 'count' rows of table data."""
+    rows = [["no", "account", "amount"]]
+    for i in range(count):
+        rows.append([i + 1, "account %i" % (i * 7919 % 1000), "%.2f" % (i * 1.37)])
+    return rows
+
+
+def run(module, count, chunk_rows, filename):
+    """Return duration, file size and page count of one report."""
+    report = module.Report(fitz.paper_rect("a4"), css=css, archive=".")
+    kwargs = {"chunk_rows": chunk_rows} if chunk_rows else {}
+    items = module.Table(
+        report=report,
+        html=HTML,
+        fetch_rows=lambda: get_rows(count),
+        top_row="toprow",
+        **kwargs,
+    )
+    report.sections = [[items]]
+    t0 = time.perf_counter()
+    report.run(filename)
+    duration = time.perf_counter() - t0
+    doc = fitz.open(filename)
+    page_count = doc.page_count
+    doc.close()
+    return duration, os.path.getsize(filename), page_count
+
+
+parser = argparse.ArgumentParser(description="benchmark reports with repeated top rows")
+parser.add_argument("-rows", default="5000,20000,80000", help="numbers of table rows")
+parser.add_argument(
+    "-chunk-rows", type=int, default=0, help="'chunk_rows' of the tested table, 0 = none"
+)
+parser.add_argument("-reference", help="other Reports version to compare with")
+args = parser.parse_args()
+
+ref = load_reference(args.reference) if args.reference else None
+tempdir = tempfile.mkdtemp()
+for count in [int(s) for s in args.rows.split(",")]:
+    filename = os.path.join(tempdir, "report.pdf")
+    t_new, size, pages = run(Reports, count, args.chunk_rows, filename)
+    line = "%6i rows, %5i pages: %7.2f sec, %7i KB" % (count, pages, t_new, size // 1024)
+    if ref is not None:
+        t_ref, ref_size, ref_pages = run(ref, count, 0, filename)
+        if ref_pages != pages:
+            raise ValueError("page count differs from '%s'" % os.path.basename(args.reference))
+        line += ", reference %7.2f sec, %7i KB" % (t_ref, ref_size // 1024)
+    os.remove(filename)
+    print(line)
+os.rmdir(tempdir)
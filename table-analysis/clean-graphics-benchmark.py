@@ -0,0 +1,97 @@
+"""
+Utility
+--------
+Time 'clean_graphics()' (clean_graphics.py) on pages full of gridline tables.
+
+A generated test page contains a square arrangement of small tables, each
+drawn with 5 horizontal and 4 vertical lines - one path per line. Every
+table must come out as one rectangle. Option '-paths' sets the numbers of
+paths to test, which are rounded to whole tables.
+
+With '-reference', a second version of clean_graphics.py is run on the same
+pages and must deliver the same rectangles - use e.g. the file produced by
+"git show <revision>:table-analysis/clean_graphics.py". Versions without
+parameter 'analysis' extract the drawings themselves, which is then part of
+their time. Versions of quadratic complexity may be slow for large pages:
+'-reference-limit' skips them above this number of paths.
+
+Usage
+------
+python clean-graphics-benchmark.py [-paths 1000,10000,100000] [-reference old.py] [-reference-limit 10000]
+"""
+import argparse
+import importlib.util
+import inspect
+import math
+import time
+
+import fitz
+
+import clean_graphics
+from page_analysis import PageAnalysis
+
+
+def table_page(count):
+    """Return a document with one page showing 'count' gridline tables."""
+    per_row = math.ceil(math.sqrt(count))
+    doc = fitz.open()
+    page = doc.new_page(width=per_row * 100 + 20, height=per_row * 70 + 20)
+    shape = page.new_shape()
+    for i in range(count):
+        x0 = 20 + (i % per_row) * 100
+        y0 = 20 + (i // per_row) * 70
+        for j in range(5):  # row borders
+            shape.draw_line((x0, y0 + j * 12), (x0 + 80, y0 + j * 12))
+            shape.finish(color=(0, 0, 0), width=0.5)
+        for j in range(4):  # column borders
+            shape.draw_line((x0 + j * 80 / 3, y0), (x0 + j * 80 / 3, y0 + 48))
+            shape.finish(color=(0, 0, 0), width=0.5)
+    shape.commit()
+    return fitz.open("pdf", doc.tobytes())
+
+
+def timed(function, page, analysis):
+    """Call function, passing 'analysis' if supported. Return time and result."""
+    kwargs = {}
+    if "analysis" in inspect.signature(function).parameters:
+        kwargs["analysis"] = analysis
+    t0 = time.perf_counter()
+    result = function(page, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+parser = argparse.ArgumentParser(description="time clean_graphics on table pages")
+parser.add_argument("-paths", default="1000,10000,100000", help="numbers of paths")
+parser.add_argument("-reference", help="another clean_graphics.py to compare with")
+parser.add_argument("-reference-limit", type=int, default=10000, help="max paths for reference")
+args = parser.parse_args()
+
+reference = None
+if args.reference:
+    spec = importlib.util.spec_from_file_location("reference", args.reference)
+    reference = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(reference)
+
+for paths in map(int, args.paths.split(",")):
+    count = max(1, round(paths / 9))  # tables
+    doc = table_page(count)
+    page = doc[0]
+    analysis = PageAnalysis(page)
+    t0 = time.perf_counter()
+    drawn = len(analysis.drawings)
+    t_extract = time.perf_counter() - t0
+    t_new, rects = timed(clean_graphics.clean_graphics, page, analysis)
+    if len(rects) != count:
+        raise ValueError("found %i tables instead of %i" % (len(rects), count))
+    text = "%5i tables (%6i paths, extraction %.3f sec): %8.3f sec" % (
+        count,
+        drawn,
+        t_extract,
+        t_new,
+    )
+    if reference is not None and paths <= args.reference_limit:
+        t_ref, ref_rects = timed(reference.clean_graphics, page, analysis)
+        if ref_rects != rects:
+            raise ValueError("reference delivers different rectangles")
+        text += ", reference %8.3f sec (%.1f times)" % (t_ref, t_ref / t_new)
+    print(text)
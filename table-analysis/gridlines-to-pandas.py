@@ -15,16 +15,43 @@ The script executes the following steps:
 
 Step 0: Open file named in the command line, read first page and determine
         the bbox of the table by reading a JSON file with the same filename.
+        Optionally process all pages and / or multiple bboxes, see below.
 Step 1: Extract x- and y-coordinates of vector graphic lines. They are
         used as cell borders.
 Step 2: Extract page text as single words and put each word string in the
         adequate cell.
 Step 3: Output Python table as a pandas DataFrame (resp. Excel file).
 
+Usage
+------
+python gridlines-to-pandas.py input.pdf [-all] [-jobs n] [-output file]
+
+The JSON file "input-bbox.json" contains the table bbox [x0, y0, x1, y1],
+or a list of several entries. An entry is either a bbox or a dictionary
+{"page": n, "bbox": [x0, y0, x1, y1]} (0-based page number). Entries without
+page number are used for page 0, or for every page if "-all" is given.
+If no JSON file exists, the full page is used.
+
+With more than one table, tables are extracted by a pool of worker
+processes and concatenated to one DataFrame, with the page number and the
+number of the JSON entry in columns "page" and "table".
+The output format is chosen by the extension of the output file: ".xlsx"
+(default) or ".csv". For ".parquet" or ".arrow" (requires pyarrow), no
+DataFrame is built: every table is appended to the file as soon as it is
+extracted, see table_sink.py.
+
 """
+import os
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import fitz
 import pandas as pd
 
+from page_analysis import PageAnalysis
+from table_sink import TableSink, sink_format
+
 """
 -------------------------------------------------------------------------
 Make minimal boundary boxes:
@@ -39,8 +66,15 @@ with gridlines.
 fitz.Tools().set_small_glyph_heights(True)
 
 
-def main(page, table_bbox):
-    """Extract table structure defined by gridlines within given table_bbox."""
+def table_cells(page, table_bbox, analysis=None):
+    """Extract table structure defined by gridlines within given table_bbox.
+
+    Returns the table as a list of rows of cell strings.
+    'analysis' is an optional PageAnalysis of the page, which avoids
+    extracting the drawings again for every table of a page.
+    """
+    if analysis is None:
+        analysis = PageAnalysis(page)
 
     # vertical / horizontal line coordinates. Python 'sets' avoid duplicates.
     vert = set()  # vertical (x-) coordinates
@@ -61,14 +95,14 @@ def main(page, table_bbox):
         """
         cidx = -1  # col index
         ridx = -1  # row index
-        for i in range(len(vert) - 1):
-            if vert[i] <= bbox.x0 < bbox.x1 <= vert[i + 1]:
-                cidx = i
-                break
-        for j in range(len(hori) - 1):
-            if hori[j] <= bbox.y0 < bbox.y1 <= hori[j + 1]:
-                ridx = j
-                break
+        # coordinates are sorted and distinct: the only candidate is the
+        # last border not exceeding the rectangle's top-left
+        i = bisect_right(vert, bbox.x0) - 1
+        if 0 <= i < len(vert) - 1 and bbox.x0 < bbox.x1 <= vert[i + 1]:
+            cidx = i
+        j = bisect_right(hori, bbox.y0) - 1
+        if 0 <= j < len(hori) - 1 and bbox.y0 < bbox.y1 <= hori[j + 1]:
+            ridx = j
         # if ridx / cidx is negative, text is contained in no table cell
         if cidx < 0 or ridx < 0:  # shouldn't happen: correct cell not found
             raise ValueError(ridx, cidx, f"=> no cell found for: '{text}'")
@@ -77,7 +111,7 @@ def main(page, table_bbox):
     # -------------------------------------------------------------------------
     # Step 1: Determine column and row borders and prepare empty Python table
     # -------------------------------------------------------------------------
-    paths = page.get_drawings()  # all line art / vector graphics on page
+    paths = analysis.drawings  # all line art / vector graphics on page
 
     for p in paths:  # iterate over vector graphis to find the lines
         if not p["rect"] in table_bbox:  # omit stuff outside table_bbox
@@ -121,6 +155,11 @@ def main(page, table_bbox):
         ridx, cidx = getcoord(fitz.Rect(w[:4]), w[4])
         cells[ridx][cidx] += w[4] + " "  # append to stuff already in that cell
 
+    return [[cell.strip() for cell in row] for row in cells]
+
+
+def make_dataframe(cells):
+    """Make a pandas DataFrame from the table cells."""
     # -------------------------------------------------------------------------
     # Step 3: Output as a pandas DataFrame. Row 0 contains column names.
     # -------------------------------------------------------------------------
@@ -138,17 +177,131 @@ def main(page, table_bbox):
     return pd.DataFrame(pd_dict)
 
 
-if __name__ == "__main__":
+def main(page, table_bbox, analysis=None):
+    """Extract the table within table_bbox as a pandas DataFrame."""
+    return make_dataframe(table_cells(page, table_bbox, analysis))
+
+
+def read_bboxes(filename):
+    """Read the table bboxes from the JSON file belonging to 'filename'.
+
+    Returns a list of (page, bbox), page is None if not specified.
+    """
     import json
     import pathlib
+
+    path = pathlib.Path(filename.replace(".pdf", "-bbox.json"))
+    if not path.exists():
+        return [(None, None)]  # use the full page
+    entries = json.loads(path.read_text())
+    if len(entries) == 4 and all(isinstance(v, (int, float)) for v in entries):
+        entries = [entries]  # a single bbox
+    bboxes = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            bboxes.append((entry.get("page"), fitz.Rect(entry["bbox"])))
+        else:
+            bboxes.append((None, fitz.Rect(entry)))
+    return bboxes
+
+
+def page_tables(filename, pno, tables):
+    """Extract the tables of one page in a separate process.
+
+    'tables' is a list of (table number, bbox). Returns a list of
+    (table number, cells, error message), one per table.
+    """
+    doc = fitz.open(filename)
+    page = doc[pno]
+    analysis = PageAnalysis(page)  # drawings are shared by all tables
+    results = []
+    for table, bbox in tables:
+        try:
+            cells = table_cells(page, page.rect if bbox is None else bbox, analysis)
+            results.append((table, cells, None))
+        except Exception as e:
+            results.append((table, None, str(e)))
+    doc.close()
+    return results
+
+
+def save(df, output):
+    """Write the DataFrame in the format given by the file extension."""
+    if os.path.splitext(output)[1].lower() == ".csv":
+        df.to_csv(output, index=False)
+    else:
+        df.to_excel(output)
+
+
+if __name__ == "__main__":
+    import argparse
     import sys
 
-    filename = sys.argv[1]
+    parser = argparse.ArgumentParser(description="extract tables defined by gridlines")
+    parser.add_argument("input", help="PDF file")
+    parser.add_argument("-all", action="store_true", help="process all pages")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-output", help="output file (default input.pdf.xlsx)")
+    args = parser.parse_args()
+
+    filename = args.input
     doc = fitz.open(filename)
-    page = doc[0]
-    # Locate table on page.
+    output = args.output or doc.name + ".xlsx"
+    # Locate tables on pages.
     # Assuming here, that we can access a JSON version.
-    clip = json.loads(pathlib.Path(filename.replace(".pdf", "-bbox.json")).read_text())
-    clip = fitz.Rect(clip)
-    df = main(page, clip)
-    df.to_excel(doc.name + ".xlsx")
+    bboxes = read_bboxes(filename)
+
+    # the tables of every page: {pno: [(table, bbox), ...]}
+    pages = {}
+    for table, (pno, bbox) in enumerate(bboxes):
+        if pno is not None:
+            pnos = [pno]
+        elif args.all:
+            pnos = range(doc.page_count)
+        else:
+            pnos = [0]
+        for pno in pnos:
+            pages.setdefault(pno, []).append((table, bbox))
+    pnos = sorted(pages.keys())
+
+    sink = TableSink(output) if sink_format(output) else None
+    if sink is None and len(bboxes) == 1 and not args.all and pnos == [0]:
+        page = doc[0]  # a single table
+        bbox = bboxes[0][1]
+        df = main(page, page.rect if bbox is None else bbox)
+        save(df, output)
+        sys.exit()
+
+    doc.close()
+    jobs = max(1, min(args.jobs, len(pnos)))
+    frames = []
+
+    def collect(pno, results):
+        for table, cells, error in results:
+            if cells is None:
+                print(f"page {pno}, table {table}: {error}", file=sys.stderr)
+            elif sink is not None:  # write immediately
+                sink.append(cells, page=pno, table=table)
+            else:
+                df = make_dataframe(cells)
+                df.insert(0, "table", table)
+                df.insert(0, "page", pno)
+                frames.append(df)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        todo = deque(pnos)
+        futures = deque()  # (pno, future) in page sequence
+        while todo or futures:
+            while todo and len(futures) < jobs * 2:  # keep workers busy
+                pno = todo.popleft()
+                futures.append((pno, executor.submit(page_tables, filename, pno, pages[pno])))
+            pno, future = futures.popleft()
+            collect(pno, future.result())
+    if sink is not None:
+        sink.close()
+        if not sink.tables:
+            sys.exit("no tables found")
+        sys.exit()
+    if not frames:
+        sys.exit("no tables found")
+    save(pd.concat(frames, ignore_index=True), output)
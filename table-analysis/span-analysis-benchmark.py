@@ -0,0 +1,94 @@
+"""
+Utility
+--------
+Measure the speed of 'span-analysis-to-pandas.py' for large tables.
+
+A page with a table of the requested size is generated and converted to a
+pandas DataFrame. Optionally, a reference version of the script is measured
+as well - typically a previous one, e.g. obtained via
+
+git show <revision>:table-analysis/span-analysis-to-pandas.py > span_analysis_ref.py
+
+Both versions must deliver identical DataFrames.
+An existing PDF can be used instead, if its table bbox is stored in a JSON
+file like "input1-bbox.json" for "input1.pdf".
+
+Usage
+------
+python span-analysis-benchmark.py [-rows 200] [-cols 12] [-input file.pdf] [-reference span_analysis_ref.py]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import time
+import fitz
+
+
+def load_script(filename, name):
+    """Import a script from a file (its name need not be a valid identifier)."""
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_table_page(rows, cols):
+    """Make a page with a table, return the page and the table bbox."""
+    width = cols * 60 + 72
+    height = (rows + 1) * 25 + 72
+    doc = fitz.open()
+    page = doc.new_page(width=width, height=height)
+    for j in range(cols):
+        page.insert_text((36 + j * 60, 50), "Column %i" % j, fontsize=8)
+    for i in range(rows):
+        y = 50 + (i + 1) * 25
+        # first column has two lines, rows are separated by larger gaps
+        page.insert_text((36, y - 9), "Item %i" % i, fontsize=8)
+        page.insert_text((36, y), "part %i-%i" % (i, i % 7), fontsize=8)
+        for j in range(1, cols):
+            page.insert_text((36 + j * 60, y), "%.2f" % ((i + 1) * (j + 3) * 1.5), fontsize=8)
+    doc = fitz.open("pdf", doc.tobytes())
+    return doc, doc[0], fitz.Rect(30, 36, width - 30, height - 30)
+
+
+def run(module, page, bbox):
+    """Return duration and DataFrame of one invocation."""
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # suppress progress print
+        df = module.main(page, bbox)
+    return time.perf_counter() - t0, df
+
+
+parser = argparse.ArgumentParser(description="benchmark span-analysis-to-pandas.py")
+parser.add_argument("-rows", type=int, default=200, help="table rows (default 200)")
+parser.add_argument("-cols", type=int, default=12, help="table columns (default 12)")
+parser.add_argument("-input", help="PDF with a table on page 1 and a bbox JSON file")
+parser.add_argument("-reference", help="other script version to compare with")
+args = parser.parse_args()
+
+folder = os.path.dirname(os.path.abspath(__file__))
+script = load_script(os.path.join(folder, "span-analysis-to-pandas.py"), "span_analysis")
+if args.input:
+    doc = fitz.open(args.input)
+    page = doc[0]
+    bbox = json.loads(pathlib.Path(args.input.replace(".pdf", "-bbox.json")).read_text())
+    bbox = fitz.Rect(bbox)
+else:
+    doc, page, bbox = make_table_page(args.rows, args.cols)
+
+t_new, df = run(script, page, bbox)
+print("table with %i rows and %i columns" % df.shape)
+print("current:   %.4f sec" % t_new)
+
+if args.reference:
+    ref = load_script(args.reference, "span_analysis_ref")
+    t_ref, ref_df = run(ref, page, bbox)
+    print("reference: %.4f sec" % t_ref)
+    print("speedup:   %.1f" % (t_ref / t_new))
+    if not ref_df.equals(df) or list(ref_df.columns) != list(df.columns):
+        raise ValueError("DataFrame differs from '%s'" % os.path.basename(args.reference))
+    print("DataFrames are identical")
@@ -17,15 +17,57 @@ Step 0: Open file named in the command line, read first page and determine
         the bbox of the table by reading a JSON file with the same filename.
 Step 1: Extract the text spans within the bbox.
 Step 2: Analyze text spans to compute rectangles: one for each column, one
-        for each row. Extract the text found at column / row intersections.
+        for each row. Extract the words of the table once and distribute
+        them to the column / row intersections.
 Step 3: Output Python table as a pandas DataFrame (resp. Excel file).
 
+Usage
+------
+python span-analysis-to-pandas.py input.pdf [-output file]
+
+The output format is chosen by the extension of the output file: ".xlsx"
+(default) or ".csv". For ".parquet" or ".arrow" (requires pyarrow), no
+DataFrame is built: the table is appended to the file, see table_sink.py.
+
 """
+from bisect import bisect_left
+
 import fitz
 import pandas as pd
 
+from table_sink import TableSink, sink_format
 
-def main(page, table_bbox):
+
+def sort_words(words, tolerance=3):
+    """Sort words line-wise, forgiving small deviations.
+
+    This is the same sorting as done by 'page.get_text("words", sort=True)'.
+    """
+    words.sort(key=lambda w: (w[3], w[0]))
+    nwords = []  # final word list
+    line = [words[0]]  # collects words roughly in same line
+    lrect = fitz.Rect(words[0][:4])  # start the line rectangle
+    for w in words[1:]:
+        wrect = fitz.Rect(w[:4])
+        if (
+            abs(wrect.y0 - lrect.y0) <= tolerance
+            or abs(wrect.y1 - lrect.y1) <= tolerance
+        ):
+            line.append(w)
+            lrect |= wrect
+        else:
+            line.sort(key=lambda w: w[0])  # sort words in line l-t-r
+            nwords.extend(line)  # append to final words list
+            line = [w]  # start next line
+            lrect = wrect  # start next line rect
+
+    line.sort(key=lambda w: w[0])  # sort words in line l-t-r
+    nwords.extend(line)  # append to final words list
+    return nwords
+
+
+def table_cells(page, table_bbox):
+    """Extract the table within table_bbox as a list of rows of cell strings."""
     page.wrap_contents()
     spans = []
     # extract spans of page
@@ -52,18 +94,28 @@ def main(page, table_bbox):
     r.y0 = top
     r.y1 = bot
     col_rects = [r]
+    # Every span is joined to the first column it intersects. Spans arrive by
+    # ascending x0, which is never smaller than the x0 of any column. So a
+    # column can only intersect spans as long as its x1 exceeds their x0:
+    # once this is no longer the case, the column is finished for good.
+    active = [0]  # numbers of unfinished columns, ascending
+    k = 0  # first unfinished column in 'active'
     for s in tspans[1:]:  # walk through remaining spans
         sr = +s[0]
         sr.y0 = top
         sr.y1 = bot
+        while k < len(active) and col_rects[active[k]].x1 <= sr.x0:
+            k += 1  # column finished
         found = False
-        for i, r in enumerate(col_rects):
+        if k < len(active):
+            i = active[k]
+            r = col_rects[i]
             if r.intersects(sr):
                 r |= sr
                 col_rects[i] = r
                 found = True
-                break
         if not found:
+            active.append(len(col_rects))
             col_rects.append(sr)
     # we have the number of columns now
 
@@ -100,13 +152,40 @@ def main(page, table_bbox):
     # store table text in the following cells
     cells = [[""] * (len(col_rects)) for j in range(len(row_rects))]
 
-    # Build intersections of each row / column rectangle and extract text
-    # inside as word strings, because we may need to sort them.
-    for i, rr in enumerate(row_rects):
-        for j, cr in enumerate(col_rects):
-            clip = rr & cr  # intersection rectangle
-            words = page.get_text("words", clip=clip, sort=True)
-            cells[i][j] = " ".join([w[4] for w in words])
+    # Extract the words of the table once. A word belongs to the row which
+    # contains its bottom coordinate, and to every column it intersects.
+    # Columns are sorted by their x0, so bisection finds the candidates.
+    # Words are collected as tuples, because we may need to sort them.
+    cell_words = [[[] for cr in col_rects] for rr in row_rects]
+    col_x0 = [cr.x0 for cr in col_rects]
+    col_x1 = []  # col_x1[j] = max x1 of columns 0 to j
+    for cr in col_rects:
+        col_x1.append(max(cr.x1, col_x1[-1]) if col_x1 else cr.x1)
+    words = page.get_text("words", clip=table_bbox | (l_border, top, r_border, bot))
+    for w in words:
+        i = bisect_left(row_y, w[3]) - 1  # row_y[i] < w.y1 <= row_y[i + 1]
+        if not 0 <= i < len(row_rects):
+            continue
+        wrect = fitz.Rect(w[:4])
+        for j in range(bisect_left(col_x0, w[2]) - 1, -1, -1):
+            if col_x1[j] <= w[0]:  # no more columns to the left of w
+                break
+            if not (row_rects[i] & col_rects[j]).intersects(wrect):
+                continue
+            cell_words[i][j].append(w)
+
+    for i in range(len(row_rects)):
+        for j in range(len(col_rects)):
+            if cell_words[i][j]:
+                words = sort_words(cell_words[i][j])
+                cells[i][j] = " ".join([w[4] for w in words])
+
+    return [[cell.strip() for cell in row] for row in cells]
+
+
+def main(page, table_bbox):
+    """Extract the table within table_bbox as a pandas DataFrame."""
+    cells = table_cells(page, table_bbox)
 
     # Now create the pandas DataFrame
     pd_dict = {}  # preapre dictionary
@@ -125,16 +204,29 @@ def main(page, table_bbox):
 
 
 if __name__ == "__main__":
+    import argparse
     import json
     import pathlib
-    import sys
 
-    filename = sys.argv[1]
+    parser = argparse.ArgumentParser(description="extract a table by span analysis")
+    parser.add_argument("input", help="PDF file")
+    parser.add_argument("-output", help="output file (default input.pdf.xlsx)")
+    args = parser.parse_args()
+
+    filename = args.input
     doc = fitz.open(filename)
+    output = args.output or doc.name + ".xlsx"
     page = doc[0]
     # Locate table on page.
     # Assuming here, that we can access a JSON version.
     clip = json.loads(pathlib.Path(filename.replace(".pdf", "-bbox.json")).read_text())
     clip = fitz.Rect(clip)
-    df = main(page, clip)
-    df.to_excel(doc.name + ".xlsx")
+    if sink_format(output):  # columnar output without a DataFrame
+        with TableSink(output) as sink:
+            sink.append(table_cells(page, clip), page=page.number)
+    else:
+        df = main(page, clip)
+        if output.lower().endswith(".csv"):
+            df.to_csv(output, index=False)
+        else:
+            df.to_excel(output)
@@ -6,12 +6,35 @@
 # maintained and developed by Artifex Software, Inc. https://artifex.com.
 # -----------------------------------------------------------------------------
 import argparse
+import contextlib
+import cProfile
+import glob
+import hashlib
+import io
+import json
+import math
+import mmap
 import os
+import random
+import re
+import shutil
+import socketserver
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
+import tracemalloc
 import bisect
+from array import array
+from collections import deque
 import fitz
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
 from fitz.fitz import (
     TEXT_INHIBIT_SPACES,
     TEXT_PRESERVE_LIGATURES,
@@ -21,6 +44,98 @@ from fitz.fitz import (
 mycenter = lambda x: (" %s " % x).center(75, "-")
 
 
+class Profiler:
+    """Record wall time, CPU time and memory allocations of program phases.
+
+    Phases may be nested. The result is written in Chrome trace format
+    (viewable with chrome://tracing or https://ui.perfetto.dev), with an
+    added summary per phase name.
+    """
+
+    def __init__(self, t0=None):
+        self.events = []
+        self.stack = []  # currently open phases
+        # worker processes pass the start time of the main process
+        self.t0 = time.perf_counter() if t0 is None else t0
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name, info):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:  # save the peak of the enclosing phase
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        entry = {"start": current, "peak": current}
+        self.stack.append(entry)
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            current, peak = tracemalloc.get_traced_memory()
+            self.stack.pop()
+            entry["peak"] = max(entry["peak"], peak)
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], entry["peak"])
+            tracemalloc.reset_peak()
+            args = dict(info)
+            args["cpu_ms"] = round(cpu * 1000, 3)
+            args["alloc_bytes"] = current - entry["start"]
+            args["alloc_peak_bytes"] = entry["peak"] - entry["start"]
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",  # a "complete" event
+                    "ts": round((wall0 - self.t0) * 1e6, 1),
+                    "dur": round(wall * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": 0,
+                    "args": args,
+                }
+            )
+
+    def summary(self):
+        """Totals per phase name."""
+        result = {}
+        for event in self.events:
+            item = result.setdefault(
+                event["name"],
+                {"count": 0, "wall_ms": 0, "cpu_ms": 0, "alloc_peak_bytes": 0},
+            )
+            item["count"] += 1
+            item["wall_ms"] += event["dur"] / 1000
+            item["cpu_ms"] += event["args"]["cpu_ms"]
+            item["alloc_peak_bytes"] = max(
+                item["alloc_peak_bytes"], event["args"]["alloc_peak_bytes"]
+            )
+        for item in result.values():
+            item["wall_ms"] = round(item["wall_ms"], 3)
+            item["cpu_ms"] = round(item["cpu_ms"], 3)
+        return result
+
+    def save(self, filename):
+        tracemalloc.stop()
+        trace = {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "summary": self.summary(),
+        }
+        with open(filename, "w") as f:
+            json.dump(trace, f, indent=1)
+
+
+profiler = None  # a Profiler if option '-profile' is used
+
+
+def phase(name, **info):
+    """Context manager measuring a program phase if profiling is active."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name, info)
+
+
 def recoverpix(doc, item):
     """Return image for a given XREF."""
     x = item[0]  # xref of PDF image
@@ -57,9 +172,17 @@ def recoverpix(doc, item):
     return getimage(pix)
 
 
-def open_file(filename, password, show=False, pdf=True):
-    """Open and authenticate a document."""
-    doc = fitz.open(filename)
+def open_file(filename, password, show=False, pdf=True, mapped=False):
+    """Open and authenticate a document.
+
+    With 'mapped', the file is memory-mapped instead of being read.
+    """
+    if mapped:
+        with open(filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        doc = fitz.open(os.path.splitext(filename)[1][1:] or "pdf", memoryview(data))
+    else:
+        doc = fitz.open(filename)
     if not doc.is_pdf and pdf is True:
         sys.exit("this command supports PDF files only")
     rc = -1
@@ -218,6 +341,186 @@ def show(args):
     doc.close()
 
 
+def stream_sizes(doc, xref, decode):
+    """Return (compressed, uncompressed) size of a stream object.
+
+    Without 'decode', the uncompressed size is taken from /DL, or estimated
+    for images. It is None if unknown.
+    """
+    t, value = doc.xref_get_key(xref, "Length")
+    if t == "xref":  # indirect /Length
+        value = doc.xref_object(int(value.split()[0]))
+    try:
+        compressed = int(value)
+    except ValueError:
+        compressed = len(doc.xref_stream_raw(xref))
+    if decode:
+        return compressed, len(doc.xref_stream(xref))
+    t, value = doc.xref_get_key(xref, "DL")
+    if t == "int":
+        return compressed, int(value)
+    if doc.xref_get_key(xref, "Filter")[0] == "null":
+        return compressed, compressed
+    if doc.xref_get_key(xref, "Subtype")[1] == "/Image":
+        try:
+            width = int(doc.xref_get_key(xref, "Width")[1])
+            height = int(doc.xref_get_key(xref, "Height")[1])
+            bpc = int(doc.xref_get_key(xref, "BitsPerComponent")[1])
+        except ValueError:
+            return compressed, None
+        t, cs = doc.xref_get_key(xref, "ColorSpace")
+        n = {"/DeviceGray": 1, "/DeviceRGB": 3, "/DeviceCMYK": 4}.get(cs, 1)
+        if t == "xref" or cs.startswith("[/ICCBased"):  # maybe ICC based
+            t, value = doc.xref_get_key(xref, "ColorSpace/N")
+            if t != "int":  # resolve [/ICCBased n 0 R]
+                refs = xref_refs(cs)
+                if refs:
+                    t, value = doc.xref_get_key(refs[-1], "N")
+            if t == "int":
+                n = int(value)
+        return compressed, (width * n * bpc + 7) // 8 * height
+    return compressed, None
+
+
+def object_category(doc, xref, contents):
+    """Return (type, subtype) of a PDF object for statistics."""
+    t, otype = doc.xref_get_key(xref, "Type")
+    otype = otype[1:] if t == "name" else ""
+    t, subtype = doc.xref_get_key(xref, "Subtype")
+    subtype = subtype[1:] if t == "name" else ""
+    if not doc.xref_is_stream(xref):
+        return (otype.lower() or "other"), subtype
+    if subtype == "Image":
+        t, value = doc.xref_get_key(xref, "Filter")
+        return "image", value.strip("[]/").replace("/", "+") if t != "null" else "raw"
+    if subtype == "Form":
+        return "xobject form", ""
+    if xref in contents:
+        return "content stream", ""
+    if otype in ("XRef", "ObjStm", "Metadata", "EmbeddedFile"):
+        return otype.lower(), subtype
+    if (
+        subtype in ("Type1C", "CIDFontType0C", "OpenType")
+        or doc.xref_get_key(xref, "Length1")[0] != "null"
+    ):
+        return "font file", subtype
+    if doc.xref_get_key(xref, "N")[0] == "int":
+        return "icc profile", ""
+    return "stream", subtype
+
+
+def object_stream_members(doc):
+    """Return the xrefs of objects stored inside object streams."""
+    members = set()
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "Type") != ("name", "/ObjStm"):
+            continue
+        t, first = doc.xref_get_key(xref, "First")
+        if t != "int":
+            continue
+        # the stream starts with pairs "xref offset"
+        header = doc.xref_stream(xref)[: int(first)].split()
+        members.update(int(x) for x in header[::2])
+    return members
+
+
+def stats(args):
+    """Report object statistics of a PDF as JSON.
+
+    Objects inside object streams have no compressed size of their own: it
+    is part of the object stream, whose uncompressed size in turn consists
+    of these objects. Both are therefore counted only once in the totals.
+    """
+    doc = open_file(args.input, args.password, pdf=True, mapped=args.mmap)
+    page_numbers = {}  # page xref -> page number
+    contents = set()  # xrefs of page content streams
+    for i in range(doc.page_count):
+        xref = doc.page_xref(i)
+        page_numbers[xref] = i + 1
+        t, value = doc.xref_get_key(xref, "Contents")
+        contents.update(xref_refs(value))
+
+    in_objstm = object_stream_members(doc)
+    by_type = {}
+    sizes = []  # (compressed size, xref) of all streams
+    referrers = {}  # xref -> xrefs of objects referencing it
+    for xref in range(1, doc.xref_length()):
+        source = doc.xref_object(xref, compressed=True)
+        if source == "null":  # free or unused entry
+            continue
+        for ref in set(xref_refs(source)):
+            referrers.setdefault(ref, []).append(xref)
+        otype, subtype = object_category(doc, xref, contents)
+        item = by_type.setdefault(
+            otype, {"count": 0, "compressed": 0, "uncompressed": 0, "subtypes": {}}
+        )
+        sub = item["subtypes"].setdefault(
+            subtype or "-", {"count": 0, "compressed": 0, "uncompressed": 0}
+        )
+        if doc.xref_is_stream(xref):
+            compressed, uncompressed = stream_sizes(doc, xref, args.decode)
+            sizes.append((compressed, xref, otype, subtype, uncompressed))
+            if otype == "objstm":  # uncompressed: counted with its objects
+                uncompressed = 0
+        elif xref in in_objstm:  # compressed: counted with the object stream
+            compressed, uncompressed = 0, len(source)
+        else:
+            compressed = uncompressed = len(source)
+        for entry in (item, sub):
+            entry["count"] += 1
+            entry["compressed"] += compressed
+            if uncompressed is None:  # unknown - report lower bound
+                entry["uncompressed_unknown"] = entry.get("uncompressed_unknown", 0) + 1
+            else:
+                entry["uncompressed"] += uncompressed
+
+    def pages_of(xref):
+        """Numbers of pages which (indirectly) reference an object."""
+        pages = set()
+        seen = {xref}
+        todo = [xref]
+        while todo:
+            x = todo.pop()
+            if x in page_numbers:
+                pages.add(page_numbers[x])
+                continue  # do not go beyond pages
+            for ref in referrers.get(x, []):
+                if ref not in seen:
+                    seen.add(ref)
+                    todo.append(ref)
+        return sorted(pages)
+
+    sizes.sort(reverse=True)
+    largest = [
+        {
+            "xref": xref,
+            "type": otype,
+            "subtype": subtype,
+            "compressed": compressed,
+            "uncompressed": uncompressed,
+            "pages": pages_of(xref),
+        }
+        for compressed, xref, otype, subtype, uncompressed in sizes[: args.top]
+    ]
+    report = {
+        "input": args.input,
+        "file_size": os.path.getsize(args.input),
+        "pages": doc.page_count,
+        "objects": doc.xref_length() - 1,
+        "by_type": dict(
+            sorted(by_type.items(), key=lambda item: item[1]["compressed"], reverse=True)
+        ),
+        "largest": largest,
+    }
+    doc.close()
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
 def poster(args):
     doc = open_file(args.input, args.password, pdf=True)
     pages = get_list(args.pages, doc.page_count + 1)
@@ -250,7 +553,30 @@ def clean(args):
     )
 
     if not args.pages:  # simple cleaning
-        doc.save(
+        with phase("save"):
+            doc.save(
+                args.output,
+                garbage=args.garbage,
+                deflate=args.compress,
+                pretty=args.pretty,
+                clean=args.sanitize,
+                ascii=args.ascii,
+                linear=args.linear,
+                encryption=encrypt,
+                owner_pw=args.owner,
+                user_pw=args.user,
+                permissions=args.permission,
+            )
+        return
+
+    # create sub document from page numbers
+    pages = get_list(args.pages, doc.page_count + 1)
+    outdoc = fitz.open()
+    with phase("copy pages"):
+        insert_pages(outdoc, doc, pages, select=True)
+    outdoc.set_metadata(doc.metadata)
+    with phase("save"):
+        outdoc.save(
             args.output,
             garbage=args.garbage,
             deflate=args.compress,
@@ -263,51 +589,79 @@ def clean(args):
             user_pw=args.user,
             permissions=args.permission,
         )
-        return
-
-    # create sub document from page numbers
-    pages = get_list(args.pages, doc.page_count + 1)
-    outdoc = fitz.open()
-    for pno in pages:
-        n = pno - 1
-        outdoc.insert_pdf(doc, from_page=n, to_page=n)
-    outdoc.set_metadata(doc.metadata)
-    outdoc.save(
-        args.output,
-        garbage=args.garbage,
-        deflate=args.compress,
-        pretty=args.pretty,
-        clean=args.sanitize,
-        ascii=args.ascii,
-        linear=args.linear,
-        encryption=encrypt,
-        owner_pw=args.owner,
-        user_pw=args.user,
-        permissions=args.permission,
-    )
     doc.close()
     outdoc.close()
     return
 
 
+def page_runs(pages):
+    """Collapse a sequence of page numbers into runs of consecutive pages.
+
+    Returns:
+        A list of tuples (first, last). Runs may be ascending or descending.
+    """
+    runs = []
+    for pno in pages:
+        if runs:
+            first, last = runs[-1]
+            step = pno - last
+            if abs(step) == 1 and (last - first) * step >= 0:  # same direction
+                runs[-1] = (first, pno)
+                continue
+        runs.append((pno, pno))
+    return runs
+
+
+def insert_pages(doc, src, pages, select=False):
+    """Append pages of 'src' to 'doc'.
+
+    Args:
+        pages: sequence of 1-based page numbers.
+        select: allow to modify 'src' in memory, see below.
+    Notes:
+        Consecutive page numbers are copied with one call each. If permitted
+        and the pages do not form one run, 'src' is reduced to the requested
+        pages instead, so everything is copied in one go. Resources shared
+        by different runs are only copied once as long as 'src' stays open.
+    """
+    runs = page_runs(pages)
+    if select and len(runs) > 1:
+        src.select([pno - 1 for pno in pages])
+        runs = [(1, src.page_count)]
+    for first, last in runs:
+        doc.insert_pdf(src, from_page=first - 1, to_page=last - 1)
+
+
 def doc_join(args):
     """Join pages from several PDF documents."""
     doc_list = args.input  # a list of input PDFs
     doc = fitz.open()  # output PDF
-    for src_item in doc_list:  # process one input PDF
-        src_list = src_item.split(",")
+    items = [src_item.split(",") for src_item in doc_list]
+    names = [src_list[0] for src_list in items]
+    sources = {}  # open input PDFs, kept open while they are still needed
+    for i, src_list in enumerate(items):  # process one input PDF
+        name = src_list[0]
         password = src_list[1] if len(src_list) > 1 else None
-        src = open_file(src_list[0], password, pdf=True)
+        src = sources.get(name)
+        if src is None:
+            src = open_file(name, password, pdf=True)
         pages = ",".join(src_list[2:])  # get 'pages' specifications
         if pages:  # if anything there, retrieve a list of desired pages
             page_list = get_list(",".join(src_list[2:]), src.page_count + 1)
         else:  # take all pages
             page_list = range(1, src.page_count + 1)
-        for i in page_list:
-            doc.insert_pdf(src, from_page=i - 1, to_page=i - 1)  # copy each source page
-        src.close()
+        reused = name in names[i + 1 :]  # source needed again later?
+        # sources used more than once must stay unchanged and open
+        with phase("copy pages", input=name):
+            insert_pages(doc, src, page_list, select=not reused)
+        if reused:
+            sources[name] = src
+        else:
+            sources.pop(name, None)
+            src.close()
 
-    doc.save(args.output, garbage=4, deflate=True)
+    with phase("save"):
+        doc.save(args.output, garbage=4, deflate=True)
     doc.close()
 
 
@@ -504,6 +858,101 @@ def embedded_list(args):
     doc.close()
 
 
+def xref_refs(source):
+    """Return the xrefs referenced in an object source."""
+    return [int(m.group(1)) for m in re.finditer(r"(\d+) \d+ R", source)]
+
+
+def content_digest(doc, xref, h=None, seen=None):
+    """Hash a PDF object and all objects it references, ignoring xref numbers.
+
+    Equal images or fonts therefore have equal digests, even when they are
+    stored under different xrefs or in different files.
+    """
+    top = h is None
+    if top:
+        h = hashlib.blake2b(digest_size=20)
+        seen = set()
+    if xref not in seen:
+        seen.add(xref)
+        source = doc.xref_object(xref, compressed=True)
+        h.update(re.sub(r"\d+ \d+ R", "R", source).encode())
+        if doc.xref_is_stream(xref):
+            h.update(doc.xref_stream_raw(xref))
+        for ref in xref_refs(source):
+            content_digest(doc, ref, h, seen)
+    if top:
+        return h.hexdigest()
+
+
+def write_file(filename, data):
+    """Write a file atomically, so parallel writers never see partial files."""
+    temp = "%s.%i.tmp" % (filename, os.getpid())
+    with open(temp, "wb") as outfile:
+        outfile.write(data)
+    os.replace(temp, filename)
+
+
+def save_font(doc, xref, out_dir, dedup):
+    """Save a font to disk, return the filename or None."""
+    fontname, ext, _, buffer = doc.extract_font(xref)
+    if ext == "n/a" or not buffer:
+        return None
+    if dedup:  # content-addressed name
+        name = hashlib.blake2b(buffer, digest_size=20).hexdigest()
+    else:
+        name = fontname.replace(" ", "-")
+    outname = os.path.join(out_dir, name + "." + ext)
+    if not (dedup and os.path.exists(outname)):
+        write_file(outname, buffer)
+    return outname
+
+
+def save_image(doc, item, out_dir, dedup):
+    """Save an image to disk, return the filename.
+
+    With 'dedup', images already stored under their content hash are
+    neither decoded nor encoded again.
+    """
+    xref = item[0]
+    if dedup:
+        name = content_digest(doc, xref)
+        stored = glob.glob(os.path.join(glob.escape(out_dir), name + ".*"))
+        if stored:
+            return stored[0]
+    else:
+        name = "img-%i" % xref
+    pix = recoverpix(doc, item)
+    if type(pix) is dict:
+        ext = pix["ext"]
+        imgdata = pix["image"]
+    else:
+        ext = "png"
+        pix2 = pix if pix.colorspace.n < 4 else fitz.Pixmap(fitz.csRGB, pix)
+        imgdata = pix2.tobytes("png")
+    outname = os.path.join(out_dir, "%s.%s" % (name, ext))
+    write_file(outname, imgdata)
+    return outname
+
+
+def save_objects(doc, fonts, images, out_dir, dedup):
+    """Save fonts and images, return a list of (kind, xref, filename)."""
+    result = []
+    for xref in fonts:
+        result.append(("fonts", xref, save_font(doc, xref, out_dir, dedup)))
+    for item in images:
+        result.append(("images", item[0], save_image(doc, item, out_dir, dedup)))
+    return result
+
+
+def extract_worker(filename, password, fonts, images, out_dir, dedup):
+    """Execute 'save_objects' in a separate process."""
+    doc = open_file(filename, password, pdf=True)
+    result = save_objects(doc, fonts, images, out_dir, dedup)
+    doc.close()
+    return result
+
+
 def extract_objects(args):
     """Extract images and / or fonts from a PDF."""
     if not args.fonts and not args.images:
@@ -522,62 +971,69 @@ def extract_objects(args):
         if not (os.path.exists(out_dir) and os.path.isdir(out_dir)):
             sys.exit("output directory %s does not exist" % out_dir)
 
-    font_xrefs = set()  # already saved fonts
-    image_xrefs = set()  # already saved images
-
-    for pno in pages:
-        if args.fonts:
-            itemlist = doc.get_page_fonts(pno - 1)
-            for item in itemlist:
-                xref = item[0]
-                if xref not in font_xrefs:
-                    font_xrefs.add(xref)
-                    fontname, ext, _, buffer = doc.extract_font(xref)
-                    if ext == "n/a" or not buffer:
-                        continue
-                    outname = os.path.join(
-                        out_dir, fontname.replace(" ", "-") + "." + ext
+    fonts = {}  # xref -> None, font xrefs in sequence of first occurrence
+    images = {}  # xref -> item of get_page_images()
+
+    with phase("scan pages"):
+        for pno in pages:
+            if args.fonts:
+                for item in doc.get_page_fonts(pno - 1):
+                    fonts.setdefault(item[0], None)
+            if args.images:
+                for item in doc.get_page_images(pno - 1):
+                    images.setdefault(item[0], item)
+    fonts = list(fonts)
+    images = list(images.values())
+
+    jobs = min(args.jobs, len(fonts) + len(images))
+    with phase("save objects"):
+        if jobs <= 1:
+            result = save_objects(doc, fonts, images, out_dir, args.dedup)
+        else:
+            # round-robin shards, several per worker to balance object sizes
+            n = jobs * 4
+            result = []
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(
+                        extract_worker,
+                        args.input,
+                        args.password,
+                        fonts[i::n],
+                        images[i::n],
+                        out_dir,
+                        args.dedup,
                     )
-                    outfile = open(outname, "wb")
-                    outfile.write(buffer)
-                    outfile.close()
-                    buffer = None
-        if args.images:
-            itemlist = doc.get_page_images(pno - 1)
-            for item in itemlist:
-                xref = item[0]
-                if xref not in image_xrefs:
-                    image_xrefs.add(xref)
-                    pix = recoverpix(doc, item)
-                    if type(pix) is dict:
-                        ext = pix["ext"]
-                        imgdata = pix["image"]
-                        outname = os.path.join(out_dir, "img-%i.%s" % (xref, ext))
-                        outfile = open(outname, "wb")
-                        outfile.write(imgdata)
-                        outfile.close()
-                    else:
-                        outname = os.path.join(out_dir, "img-%i.png" % xref)
-                        pix2 = (
-                            pix
-                            if pix.colorspace.n < 4
-                            else fitz.Pixmap(fitz.csRGB, pix)
-                        )
-                        pix2.save(outname)
+                    for i in range(n)
+                ]
+                for future in futures:
+                    result += future.result()
+
+    if args.dedup:  # map xrefs to the content-addressed files
+        manifest = {"input": os.path.abspath(args.input), "fonts": {}, "images": {}}
+        for kind, xref, outname in sorted(result):
+            manifest[kind][str(xref)] = outname and os.path.basename(outname)
+        manifest_name = os.path.join(
+            out_dir, os.path.basename(args.input) + ".manifest.json"
+        )
+        with open(manifest_name, "w") as f:
+            json.dump(manifest, f, indent=1)
 
     if args.fonts:
-        print("saved %i fonts to '%s'" % (len(font_xrefs), out_dir))
+        print("saved %i fonts to '%s'" % (len(fonts), out_dir))
     if args.images:
-        print("saved %i images to '%s'" % (len(image_xrefs), out_dir))
+        print("saved %i images to '%s'" % (len(images), out_dir))
     doc.close()
 
 
-def page_simple(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
+def page_simple(
+    page, textout, GRID, fontsize, noformfeed, skip_empty, flags, textpage=None
+):
     if noformfeed:
         eop = b"\n"
     else:
         eop = bytes([12])
-    text = page.get_text("text", flags=flags)
+    text = page.get_text("text", flags=flags, textpage=textpage)
     if not text:
         if not skip_empty:
             textout.write(eop)  # write formfeed
@@ -587,12 +1043,14 @@ def page_simple(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
     return
 
 
-def page_blocksort(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
+def page_blocksort(
+    page, textout, GRID, fontsize, noformfeed, skip_empty, flags, textpage=None
+):
     if noformfeed:
         eop = b"\n"
     else:
         eop = bytes([12])
-    blocks = page.get_text("blocks", flags=flags)
+    blocks = page.get_text("blocks", flags=flags, textpage=textpage)
     if blocks == []:
         if not skip_empty:
             textout.write(eop)  # write formfeed
@@ -604,12 +1062,9 @@ def page_blocksort(page, textout, GRID, fontsize, noformfeed, skip_empty, flags)
     return
 
 
-def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
-    left = page.rect.width  # left most used coordinate
-    right = 0  # rightmost coordinate
-    rowheight = page.rect.height  # smallest row height in use
-    chars = []  # all chars here
-    rows = set()  # bottom coordinates of lines
+def page_layout(
+    page, textout, GRID, fontsize, noformfeed, skip_empty, flags, textpage=None
+):
     if noformfeed:
         eop = b"\n"
     else:
@@ -629,50 +1084,33 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
         return nrows  # curated list of line bottom coordinates
 
     # --------------------------------------------------------------------
-    def curate_rows(rows, GRID):
-        """Make list of integer y-coordinates of lines on page.
-
-        Coordinates will be ascending and differ by 'GRID' points or more."""
-        rows = list(rows)
-        rows.sort()  # sort ascending
-        nrows = [rows[0]]
-        for h in rows[1:]:
-            if h >= nrows[-1] + GRID:  # only keep significant differences
-                nrows.append(h)
-        return nrows  # curated list of line bottom coordinates
+    def make_lines(rows, oys, order):
+        """Distribute the characters over the lines.
 
-    # --------------------------------------------------------------------
-    def find_line_index(values: List[int], value: int) -> int:
-        """Find the right row coordinate (using bisect std package).
+        Every distinct origin.y is looked up only once in the sorted line
+        coordinates (bisect). Characters are then dealt out in x-sorted
+        sequence, so every line receives its char indices sorted.
 
         Args:
-            values: (list) y-coordinates of rows.
-            value: (int) lookup for this value (y-origin of char).
+            rows: (list) curated, ascending y-coordinates of lines.
+            oys: (array) y-origin of each char.
+            order: (list) char indices sorted by x-origin.
         Returns:
-            y-ccordinate of appropriate line for value.
+            List of (line y-coordinate, char index list), ascending y.
         """
-        i = bisect.bisect_right(values, value)
-        if i:
-            return values[i - 1]
-        raise RuntimeError("Line for %g not found in %s" % (value, values))
+        line_of = {}  # key: origin.y, value: line number
+        for oy in set(oys):
+            i = bisect.bisect_right(rows, oy)
+            if not i:
+                raise RuntimeError("Line for %g not found in %s" % (oy, rows))
+            line_of[oy] = i - 1
+        members = [[] for _ in rows]
+        for i in order:
+            members[line_of[oys[i]]].append(i)
+        return [(rows[k], m) for k, m in enumerate(members) if m]
 
     # --------------------------------------------------------------------
-    def make_lines(chars):
-        lines = {}  # key: y1-ccordinate, value: char list
-        for c in chars:
-            ch, ox, oy, cwidth = c
-            y = find_line_index(rows, oy)  # index of origin.y
-            lchars = lines.get(y, [])  # read line chars so far
-            lchars.append(c)
-            lines[y] = lchars  # write back to line
-
-        # ensure line coordinates are ascending
-        keys = list(lines.keys())
-        keys.sort()
-        return lines, keys
-
-    # --------------------------------------------------------------------
-    def compute_slots(keys, lines, right, left):
+    def compute_slots(lines, cwidths, right, left):
         """Compute "char resolution" for the page.
 
         The char width corresponding to 1 text char position on output - call
@@ -684,14 +1122,12 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
         """
         slot = used_width = right - left
         lineslots = {}
-        for k in keys:
-            lchars = lines[k]  # char tuples of line
+        for k, lchars in lines:
             ccount = len(lchars)  # how many
             if ccount < 2:  # if short line, just put in something
                 lineslots[k] = (1, 1, 1)
                 continue
-            widths = [c[3] for c in lchars]  # list of all char widths
-            widths.sort()
+            widths = sorted([cwidths[i] for i in lchars])  # all char widths
             line_width = sum(widths)  # total width used by line
             i = int(ccount / 2 + 0.5)  # index of median
             median = widths[i]  # take the median value
@@ -729,18 +1165,28 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
 
     # --------------------------------------------------------------------
     def process_blocks(page, flags):
+        """Collect the page characters in column arrays.
+
+        Returns:
+            rows, chars, rowheight, left, right - where 'chars' is a tuple of
+            the columns (char list, x-origins, y-origins, char widths).
+        """
+        page_height = page.rect.height
         left = page.rect.width  # left most used coordinate
         right = 0  # rightmost coordinate
-        rowheight = page.rect.height  # smallest row height in use
-        chars = []  # all chars here
-        rows = set()  # bottom coordinates of lines
-        blocks = page.get_text("rawdict", flags=flags)["blocks"]
+        rowheight = page_height  # smallest row height in use
+        chs = []  # the characters
+        oxs = array("d")  # their origin.x
+        oys = array("l")  # their (integer) origin.y
+        cwidths = array("d")  # their widths
+        with phase("rawdict", page=page.number + 1):
+            blocks = page.get_text("rawdict", flags=flags, textpage=textpage)["blocks"]
         for block in blocks:
             for line in block["lines"]:
                 if line["dir"] != (1, 0):  # ignore non-horizontal text
                     continue
                 x0, y0, x1, y1 = line["bbox"]
-                if y1 < 0 or y0 > page.rect.height:  # ignore if outside CropBox
+                if y1 < 0 or y0 > page_height:  # ignore if outside CropBox
                     continue
                 # upd row height
                 height = y1 - y0
@@ -755,16 +1201,15 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
                         cwidth = x1 - x0
                         ox, oy = c["origin"]
                         oy = int(round(oy))
-                        rows.add(oy)
                         ch = c["c"]
                         if left > ox and ch != " ":
                             left = ox  # update left coordinate
                         if right < x1:
                             right = x1  # update right coordinate
                         # handle ligatures:
-                        if cwidth == 0 and chars != []:  # potential ligature
-                            old_ch, old_ox, old_oy, old_cwidth = chars[-1]
-                            if old_oy == oy:  # ligature!
+                        if cwidth == 0 and chs != []:  # potential ligature
+                            old_ch = chs[-1]
+                            if oys[-1] == oy:  # ligature!
                                 if old_ch != chr(0xFB00):  # previous "ff" char lig?
                                     lig = joinligature(old_ch + ch)  # 2-char
                                 # convert to one of the 3-char ligatures:
@@ -774,41 +1219,45 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
                                     lig = chr(0xFB04)  # "ffl"
                                 else:  # something wrong, leave old char in place
                                     lig = old_ch
-                                chars[-1] = (lig, old_ox, old_oy, old_cwidth)
+                                chs[-1] = lig
                                 continue
-                        chars.append((ch, ox, oy, cwidth))  # all chars on page
-        return rows, chars, rowheight, left, right
+                        chs.append(ch)  # all chars on page
+                        oxs.append(ox)
+                        oys.append(oy)
+                        cwidths.append(cwidth)
+        rows = set(oys)  # bottom coordinates of lines
+        return rows, (chs, oxs, oys, cwidths), rowheight, left, right
 
     # --------------------------------------------------------------------
-    def make_textline(left, slot, lineslots, lchars):
+    def make_textline(left, slot, lineslots, lchars, chs, oxs, cwidths):
         """Produce the text of one output line.
 
         Args:
             left: (float) left most coordinate used on page
             slot: (float) avg width of one character in any font in use.
-            minslot: (float) min width for the characters in this line.
-            chars: (list[tuple]) characters of this line.
+            lineslots: (tuple) min, median, max char width in this line.
+            lchars: (list[int]) indices of the characters of this line.
+            chs, oxs, cwidths: (arrays) characters, x-origins and widths.
         Returns:
             text: (str) text string for this line
         """
         minslot, median, maxslot = lineslots
-        text = ""  # we output this
+        parts = []  # we output the join of this
+        length = 0  # current length of the output text
+        last = ""  # last character of the output text
         old_x1 = 0  # end coordinate of last char
         old_ox = 0  # x-origin of last char
         if minslot <= fitz.EPSILON:
             raise RuntimeError("program error: minslot too small = %g" % minslot)
 
-        for c in lchars:  # loop over characters
-            char, ox, _, cwidth = c
-            ox = ox - left  # its (relative) start coordinate
+        for i in lchars:  # loop over characters
+            char = chs[i]
+            cwidth = cwidths[i]
+            ox = oxs[i] - left  # its (relative) start coordinate
             x1 = ox + cwidth  # ending coordinate
 
             # eliminate overprint effect
-            if (
-                old_ox <= ox < old_x1
-                and char == text[-1]
-                and ox - old_ox <= cwidth * 0.2
-            ):
+            if old_ox <= ox < old_x1 and char == last and ox - old_ox <= cwidth * 0.2:
                 continue
 
             # omit spaces overlapping previous char
@@ -816,25 +1265,25 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
                 continue
 
             # close enough to previous?
-            if ox < old_x1 + minslot:  # assume char adjacent to previous
-                text += char  # append to output
-                old_x1 = x1  # new end coord
-                old_ox = ox  # new origin.x
-                continue
-
-            # else next char starts after some gap:
-            # fill in right number of spaces, so char is positioned
-            # in the right slot of the line
-            delta = int(ox / slot) - len(text)
-            if delta > 1 and ox <= old_x1 + slot * 2:
-                delta = 1
-            if ox > old_x1 and delta >= 1:
-                text += " " * delta
+            if ox >= old_x1 + minslot:  # else assume char adjacent to previous
+                # next char starts after some gap:
+                # fill in right number of spaces, so char is positioned
+                # in the right slot of the line
+                delta = int(ox / slot) - length
+                if delta > 1 and ox <= old_x1 + slot * 2:
+                    delta = 1
+                if ox > old_x1 and delta >= 1:
+                    parts.append(" " * delta)
+                    length += delta
+                    last = " "
             # now append char
-            text += char
+            parts.append(char)
+            length += len(char)
+            if char:
+                last = char[-1]
             old_x1 = x1  # new end coordinate
             old_ox = ox  # new origin
-        return text.rstrip()
+        return "".join(parts).rstrip()
 
     # extract page text by single characters ("rawdict")
     rows, chars, rowheight, left, right = process_blocks(page, flags)
@@ -842,31 +1291,315 @@ def page_layout(page, textout, GRID, fontsize, noformfeed, skip_empty, flags):
         if not skip_empty:
             textout.write(eop)  # write formfeed
         return
+    chs, oxs, oys, cwidths = chars
+
     # compute list of line coordinates - ignoring small (GRID) differences
     rows = curate_rows(rows, GRID)
 
     # sort all chars by x-coordinates, so every line will receive
     # them sorted.
-    chars.sort(key=lambda c: c[1])
+    order = sorted(range(len(chs)), key=oxs.__getitem__)
 
-    # populate the lines with their char tuples
-    lines, keys = make_lines(chars)
+    # populate the lines with their char indices
+    lines = make_lines(rows, oys, order)
 
-    slot, lineslots = compute_slots(keys, lines, right, left)
+    slot, lineslots = compute_slots(lines, cwidths, right, left)
 
     # compute line advance in text output
     rowheight = rowheight * (rows[-1] - rows[0]) / (rowheight * len(rows)) * 1.5
     rowpos = rows[0]  # first line positioned here
-    textout.write(b"\n")
-    for k in keys:  # walk through the lines
+    output = [b"\n"]
+    for k, lchars in lines:  # walk through the lines
         while rowpos < k:  # honor distance between lines
-            textout.write(b"\n")
+            output.append(b"\n")
             rowpos += rowheight
-        text = make_textline(left, slot, lineslots[k], lines[k])
-        textout.write((text + "\n").encode("utf8", errors="surrogatepass"))
+        text = make_textline(left, slot, lineslots[k], lchars, chs, oxs, cwidths)
+        output.append((text + "\n").encode("utf8", errors="surrogatepass"))
         rowpos = k + rowheight
 
-    textout.write(eop)  # write end-of-page
+    output.append(eop)  # write end-of-page
+    textout.write(b"".join(output))
+
+
+class TextCache:
+    """Persistent store of extracted page text in an SQLite database.
+
+    Entries are keyed by a hash over the page's /Contents streams, its
+    (possibly inherited) /Resources including all objects referenced from
+    there, the page geometry and the extraction settings. Pages which did
+    not change since a previous run are therefore served from the cache.
+    Least recently used entries are removed when the total text size
+    exceeds 'maxsize' bytes.
+    """
+
+    version = "1"  # change when extraction output changes
+
+    def __init__(self, filename, maxsize):
+        self.db = sqlite3.connect(filename)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                chunk BLOB,
+                blocks INTEGER,
+                size INTEGER,
+                used REAL)"""
+        )
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.digests = {}  # xref -> digest, objects shared between pages
+
+    def object_digest(self, doc, xref):
+        """Hash a PDF object and all objects it references."""
+        digest = self.digests.get(xref)
+        if digest is not None:
+            return digest
+        self.digests[xref] = b""  # protect against reference cycles
+        h = hashlib.blake2b(digest_size=20)
+        source = doc.xref_object(xref, compressed=True)
+        h.update(source.encode())
+        if doc.xref_is_stream(xref):
+            # image data is irrelevant for text: only hash the dictionary
+            if doc.xref_get_key(xref, "Subtype") != ("name", "/Image"):
+                h.update(doc.xref_stream_raw(xref))
+        for ref in xref_refs(source):
+            h.update(self.object_digest(doc, ref))
+        digest = h.digest()
+        self.digests[xref] = digest
+        return digest
+
+    def page_key(self, doc, pno, settings):
+        """Compute the cache key of a page for some extraction settings."""
+        page = doc[pno]
+        h = hashlib.blake2b(digest_size=20)
+        h.update(("%s %s" % (self.version, settings)).encode())
+        h.update(("%s %s %s" % (page.cropbox, page.mediabox, page.rotation)).encode())
+        for xref in page.get_contents():
+            h.update(self.object_digest(doc, xref))
+
+        xref = page.xref  # look up the resources, possibly inherited
+        while xref:
+            t, value = doc.xref_get_key(xref, "Resources")
+            if t != "null":
+                h.update(value.encode())
+                for ref in xref_refs(value):
+                    h.update(self.object_digest(doc, ref))
+                break
+            t, value = doc.xref_get_key(xref, "Parent")
+            xref = int(value.split()[0]) if t == "xref" else 0
+        return h.hexdigest()
+
+    def contains(self, key):
+        cursor = self.db.execute("SELECT 1 FROM pages WHERE key = ?", (key,))
+        return cursor.fetchone() is not None
+
+    def get(self, key):
+        """Return (chunk, blocks) of a cached page and mark it as used."""
+        chunk, blocks = self.db.execute(
+            "SELECT chunk, blocks FROM pages WHERE key = ?", (key,)
+        ).fetchone()
+        self.db.execute("UPDATE pages SET used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return bytes(chunk), blocks
+
+    def put(self, key, chunk, blocks):
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+            (key, chunk, blocks, len(chunk), time.time()),
+        )
+        self.misses += 1
+
+    def close(self):
+        """Evict least recently used entries beyond 'maxsize', then close."""
+        total = self.db.execute("SELECT SUM(size) FROM pages").fetchone()[0] or 0
+        evicted = 0
+        if total > self.maxsize:
+            rows = self.db.execute("SELECT key, size FROM pages ORDER BY used").fetchall()
+            for key, size in rows:
+                if total <= self.maxsize:
+                    break
+                self.db.execute("DELETE FROM pages WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        self.db.commit()
+        self.db.close()
+        return evicted
+
+
+def get_page_text(
+    page, mode, GRID, fontsize, noformfeed, skip_empty, flags, counts=False
+):
+    """Extract the text of one page.
+
+    Returns:
+        A tuple (chunk, blocks, seconds): the page output as bytes (including
+        end-of-page), the number of text blocks (only if 'counts' is True,
+        else None) and the extraction duration.
+    """
+    func = {
+        "simple": page_simple,
+        "blocks": page_blocksort,
+        "layout": page_layout,
+    }
+    t0 = time.perf_counter()
+    with phase("textpage", page=page.number + 1):
+        textpage = page.get_textpage(flags=flags)  # shared by all extractions
+    textout = io.BytesIO()
+    with phase(mode, page=page.number + 1):
+        func[mode](
+            page,
+            textout,
+            GRID,
+            fontsize,
+            noformfeed,
+            skip_empty,
+            flags=flags,
+            textpage=textpage,
+        )
+    blocks = None
+    if counts:
+        with phase("counts", page=page.number + 1):
+            blocks = len([b for b in textpage.extractBLOCKS() if b[6] == 0])
+    return textout.getvalue(), blocks, time.perf_counter() - t0
+
+
+def gettext_worker(filename, password, pagel, mode, GRID, fontsize, noformfeed, skip_empty, flags, counts, profile_t0=None):
+    """Extract text from a shard of pages in a separate process.
+
+    Every worker opens its own document. Returns a list of the results of
+    'get_page_text', one per page, in the sequence of 'pagel', and a list of
+    the profiling events of the shard. Profiling is active if 'profile_t0',
+    the start time of the main process's profiler, is given.
+    """
+    global profiler
+    profiler = None if profile_t0 is None else Profiler(profile_t0)
+    doc = open_file(filename, password, pdf=False)
+    results = [
+        get_page_text(
+            doc[pno - 1], mode, GRID, fontsize, noformfeed, skip_empty, flags, counts
+        )
+        for pno in pagel
+    ]
+    doc.close()
+    events = []
+    if profiler is not None:
+        tracemalloc.stop()
+        events = profiler.events
+        profiler = None
+    return results, events
+
+
+def gettext_pages(doc, args, pagel, flags, counts=False, cache=None):
+    """Generate (pno, chunk, blocks, seconds) for the pages in 'pagel'.
+
+    Pages are delivered in sequence of 'pagel' as soon as they are done.
+    If a cache is given, unchanged pages are taken from it and only the
+    remaining pages are extracted - their results are stored in the cache.
+    """
+    if cache is None:
+        yield from extract_pages(doc, args, pagel, flags, counts)
+        return
+
+    settings = (
+        args.mode,
+        flags,
+        args.grid,
+        args.fontsize,
+        args.noformfeed,
+        args.skip_empty,
+    )
+    keys = [cache.page_key(doc, pno - 1, settings) for pno in pagel]
+    missing = [pno for pno, key in zip(pagel, keys) if not cache.contains(key)]
+    extracted = extract_pages(doc, args, missing, flags, True)
+    missing = deque(missing)
+    for pno, key in zip(pagel, keys):
+        t0 = time.perf_counter()
+        if missing and missing[0] == pno:  # extract
+            missing.popleft()
+            result = next(extracted)
+            cache.put(key, result[1], result[2])
+            yield result
+        else:
+            chunk, blocks = cache.get(key)
+            yield (pno, chunk, blocks, time.perf_counter() - t0)
+
+
+def extract_pages(doc, args, pagel, flags, counts=False):
+    """Generate (pno, chunk, blocks, seconds) for the pages in 'pagel'.
+
+    Pages are delivered in sequence of 'pagel' as soon as they are done.
+    With more than one job, contiguous shards of pages are processed by a
+    pool of worker processes. Only a limited number of shards is in flight
+    at any time, so memory stays bounded independent of the document size.
+    """
+    jobs = min(args.jobs, len(pagel))
+    if jobs <= 1:
+        for pno in pagel:
+            result = get_page_text(
+                doc[pno - 1],
+                args.mode,
+                args.grid,
+                args.fontsize,
+                args.noformfeed,
+                args.skip_empty,
+                flags,
+                counts,
+            )
+            yield (pno,) + result
+        return
+
+    # contiguous shards, several per worker to balance uneven pages
+    size = max(1, min(len(pagel) // (jobs * 4), 32))
+    shards = [pagel[i : i + size] for i in range(0, len(pagel), size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+
+        def submit(shard):
+            return executor.submit(
+                gettext_worker,
+                args.input,
+                args.password,
+                shard,
+                args.mode,
+                args.grid,
+                args.fontsize,
+                args.noformfeed,
+                args.skip_empty,
+                flags,
+                counts,
+                None if profiler is None else profiler.t0,
+            )
+
+        shards = deque(shards)
+        futures = deque()  # (shard, future) in page sequence
+        while shards or futures:
+            while shards and len(futures) < jobs * 2:  # keep workers busy
+                shard = shards.popleft()
+                futures.append((shard, submit(shard)))
+            shard, future = futures.popleft()
+            results, events = future.result()
+            if profiler is not None:  # phases of the worker
+                profiler.events.extend(events)
+            for pno, result in zip(shard, results):
+                yield (pno,) + result
+
+
+def write_page(textout, jsonl, eop, pno, chunk, blocks, seconds):
+    """Write the text of one page, either plain or as a JSON record."""
+    if not jsonl:
+        textout.write(chunk)
+        return
+    if not chunk:  # empty page and 'skip_empty'
+        return
+    text = chunk[: -len(eop)].decode("utf8", errors="surrogatepass")
+    record = {
+        "page": pno,
+        "text": text,
+        "blocks": blocks,
+        "lines": len([l for l in text.splitlines() if l.strip()]),
+        "time": round(seconds, 6),
+    }
+    textout.write(json.dumps(record).encode() + b"\n")
+    textout.flush()  # hand out every page immediately
 
 
 def gettext(args):
@@ -875,8 +1608,11 @@ def gettext(args):
     output = args.output
     if output == None:
         filename, _ = os.path.splitext(doc.name)
-        output = filename + ".txt"
-    textout = open(output, "wb")
+        output = filename + (".jsonl" if args.format == "jsonl" else ".txt")
+    if output == "-":
+        textout = sys.stdout.buffer
+    else:
+        textout = open(output, "wb")
     flags = TEXT_PRESERVE_LIGATURES | TEXT_PRESERVE_WHITESPACE
     if args.convert_white:
         flags ^= TEXT_PRESERVE_WHITESPACE
@@ -884,34 +1620,478 @@ def gettext(args):
         flags ^= TEXT_PRESERVE_LIGATURES
     if args.extra_spaces:
         flags ^= TEXT_INHIBIT_SPACES
-    func = {
-        "simple": page_simple,
-        "blocks": page_blocksort,
-        "layout": page_layout,
-    }
-    for pno in pagel:
-        page = doc[pno - 1]
-        func[args.mode](
-            page,
-            textout,
-            args.grid,
-            args.fontsize,
-            args.noformfeed,
-            args.skip_empty,
-            flags=flags,
+    eop = b"\n" if args.noformfeed else bytes([12])
+    jsonl = args.format == "jsonl"
+
+    cache = None
+    if args.cache and doc.is_pdf:
+        cache = TextCache(args.cache, int(args.cache_size * 1024 * 1024))
+    results = gettext_pages(doc, args, pagel, flags, jsonl, cache)
+
+    for pno, chunk, blocks, seconds in results:
+        with phase("write", page=pno):
+            write_page(textout, jsonl, eop, pno, chunk, blocks, seconds)
+
+    doc.close()
+    if output != "-":
+        textout.close()
+    if cache:
+        evicted = cache.close()
+        print(
+            "cache: %i hits, %i misses, %i evicted" % (cache.hits, cache.misses, evicted),
+            file=sys.stderr,
         )
 
-    textout.close()
 
+BATCH_COMMANDS = ("show", "clean", "extract", "gettext")
+batch_parser = None  # command parser of a batch worker process
 
-def main():
+
+def batch_argv(command, filename, rest):
+    """Make the command line of a batch command for one input file."""
+    stem, _ = os.path.splitext(filename)
+    fields = {
+        "{dir}": os.path.dirname(filename) or ".",
+        "{name}": os.path.basename(stem),
+        "{stem}": stem,
+    }
+    argv = [command, filename]
+    for arg in rest:
+        for key, value in fields.items():
+            arg = arg.replace(key, value)
+        argv.append(arg)
+    return argv
+
+
+def batch_output(args):
+    """Return the file or folder a command writes to (None if stdout)."""
+    if args.func is gettext:
+        if args.output:
+            return args.output
+        stem, _ = os.path.splitext(args.input)
+        return stem + (".jsonl" if args.format == "jsonl" else ".txt")
+    if args.func is extract_objects:
+        return args.output if args.output else os.path.abspath(os.curdir)
+    if args.func is clean:
+        return args.output
+    return None
+
+
+def batch_init():
+    """Prepare a worker process: build the command parser only once."""
+    global batch_parser
+    batch_parser = make_parser()
+
+
+def batch_pool(jobs):
+    """Return a process pool for batch commands with all workers started."""
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=batch_init)
+    for _ in range(jobs):  # start and warm up all workers now
+        executor.submit(batch_init)
+    return executor
+
+
+def batch_worker(argv, cwd=None):
+    """Execute one command of a batch in a worker process.
+
+    Args:
+        argv: (list) the command line, starting with the command.
+        cwd: (str) execute in this folder if given.
+    Returns:
+        The manifest record of the input file.
+    """
+    if batch_parser is None:
+        batch_init()
+    record = {
+        "input": None,  # known after parsing: options may precede it
+        "status": "ok",
+        "output": None,
+    }
+    t0 = time.perf_counter()
+    # binary capable, so "gettext -output -" can be captured, too
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf8", write_through=True)
+    stderr = io.StringIO()
+    old_cwd = os.getcwd()  # the worker process executes further commands
+    try:
+        if cwd:
+            os.chdir(cwd)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            args = batch_parser.parse_args(argv)
+            record["input"] = args.input
+            record["output"] = batch_output(args)
+            args.func(args)
+    except SystemExit as e:  # our commands exit on errors
+        if e.code:
+            record["status"] = "error"
+            record["error"] = str(e.code)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        os.chdir(old_cwd)
+    record["seconds"] = round(time.perf_counter() - t0, 4)
+    text = stdout.buffer.getvalue().decode("utf8", errors="replace")
+    if text:
+        record["stdout"] = text
+    if stderr.getvalue():
+        record["stderr"] = stderr.getvalue()
+    return record
+
+
+def batch_options(args):
+    """Take batch options given after the command out of its arguments.
+
+    So "batch -from-dir in clean ..." and "batch clean -from-dir in ..." are
+    the same. Option '-jobs' after the command is an option of the command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="batch", add_help=False, allow_abbrev=False, argument_default=argparse.SUPPRESS
+    )
+    parser.add_argument("-from-dir")
+    parser.add_argument("-from-list")
+    parser.add_argument("-pattern")
+    parser.add_argument("-recursive", action="store_true")
+    parser.add_argument("-manifest")
+    parser.add_argument("-resume", action="store_true")
+    _, args.args = parser.parse_known_args(args.args, namespace=args)
+
+
+def batch(args):
+    """Execute a command for many input files in a pool of processes.
+
+    Only a limited number of files is in flight at any time. If a worker
+    process dies, the files in flight are recorded as errors and processing
+    continues with a new pool of workers.
+    """
+    batch_options(args)
+    if not args.from_dir and not args.from_list:
+        sys.exit("specify '-from-dir' and / or '-from-list'")
+    files = []
+    if args.from_dir:
+        if args.recursive:
+            pattern = os.path.join(args.from_dir, "**", args.pattern)
+        else:
+            pattern = os.path.join(args.from_dir, args.pattern)
+        files += sorted(glob.glob(pattern, recursive=args.recursive))
+    if args.from_list:
+        with open(args.from_list) as f:
+            files += [l.strip() for l in f if l.strip()]
+
+    done = set()
+    if args.resume and os.path.exists(args.manifest):
+        with open(args.manifest) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # e.g. truncated by an interrupted run
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["input"])
+    files = [f for f in files if f not in done]
+    if not files:
+        print("nothing to do")
+        return
+
+    # check the command arguments before starting any process
+    make_parser().parse_args(batch_argv(args.command, files[0], args.args))
+
+    counts = {"ok": 0, "error": 0}
+    jobs = max(1, args.jobs)
+    pool = [batch_pool(jobs)]  # the current pool, replaced when broken
+
+    def restart(executor):
+        """Replace a broken pool, unless this has been done already."""
+        if pool[0] is executor:
+            executor.shutdown(wait=False)
+            pool[0] = batch_pool(jobs)
+
+    def submit(filename):
+        """Return pool and future of the command for one input file."""
+        argv = batch_argv(args.command, filename, args.args)
+        executor = pool[0]
+        try:
+            return executor, executor.submit(batch_worker, argv)
+        except BrokenProcessPool:  # a worker died since the last result
+            restart(executor)
+            return pool[0], pool[0].submit(batch_worker, argv)
+
+    todo = deque(files)
+    pending = deque()  # (input, pool, future) in sequence of 'files'
+    try:
+        with open(args.manifest, "a" if args.resume else "w") as manifest:
+            while todo or pending:
+                while todo and len(pending) < jobs * 2:  # keep workers busy
+                    filename = todo.popleft()
+                    pending.append((filename,) + submit(filename))
+                filename, executor, future = pending.popleft()
+                try:
+                    record = future.result()
+                except BrokenProcessPool:  # all files in flight of the pool fail
+                    restart(executor)
+                    record = {
+                        "input": filename,
+                        "status": "error",
+                        "output": None,
+                        "error": "worker process terminated abruptly",
+                    }
+                counts[record["status"]] += 1
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+    finally:
+        pool[0].shutdown()
+    print(
+        "processed %i files: %i ok, %i errors, %i skipped"
+        % (len(files), counts["ok"], counts["error"], len(done))
+    )
+
+
+def serve(args):
+    """Execute commands received via a UNIX socket in warm worker processes.
+
+    Each connection sends one JSON line {"argv": [command, input, ...],
+    "cwd": folder} and receives the result record of 'batch_worker' as one
+    JSON line. Every request receives a record, also if it fails. If a
+    worker process dies (e.g. MuPDF crashing on a damaged file), its request
+    fails and the pool is replaced by a new one.
+    """
+    if os.path.exists(args.socket):
+        os.remove(args.socket)  # left over from a previous run
+    jobs = max(1, args.jobs)
+    pool = [batch_pool(jobs)]  # the current pool, replaced when broken
+    lock = threading.Lock()
+
+    def execute(argv, cwd):
+        """Execute a command in the pool, return its result record."""
+        with lock:
+            executor = pool[0]
+        try:
+            return executor.submit(batch_worker, argv, cwd).result()
+        except BrokenProcessPool:
+            with lock:
+                if pool[0] is executor:  # not yet replaced by another request
+                    executor.shutdown(wait=False)
+                    pool[0] = batch_pool(jobs)
+            return {"status": "error", "error": "worker process terminated abruptly"}
+        except Exception as e:
+            return {"status": "error", "error": "%s: %s" % (type(e).__name__, e)}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+                argv = request["argv"]
+                if not argv or argv[0] not in BATCH_COMMANDS:
+                    raise ValueError("command must be one of %s" % (BATCH_COMMANDS,))
+                cwd = request.get("cwd")
+            except (ValueError, KeyError, TypeError) as e:
+                record = {"status": "error", "error": "bad request: %s" % e}
+            else:
+                record = execute(argv, cwd)
+            self.wfile.write(json.dumps(record).encode() + b"\n")
+
+    server = socketserver.ThreadingUnixStreamServer(args.socket, Handler)
+    server.daemon_threads = True
+    print("serving on '%s' with %i workers" % (args.socket, jobs))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool[0].shutdown()
+        os.remove(args.socket)
+
+
+def client(args):
+    """Let a 'serve' process execute a command."""
+    import fitzclient
+
+    sys.exit(fitzclient.run(args.socket, [args.command] + args.args))
+
+
+BENCH_OPS = {  # operation: command line, {input} and {out} are replaced
+    "simple": ["gettext", "{input}", "-mode", "simple", "-output", "{out}.txt"],
+    "blocks": ["gettext", "{input}", "-mode", "blocks", "-output", "{out}.txt"],
+    "layout": ["gettext", "{input}", "-mode", "layout", "-output", "{out}.txt"],
+    "images": ["extract", "{input}", "-images", "-output", "{out}"],
+    "fonts": ["extract", "{input}", "-fonts", "-output", "{out}"],
+    "clean": ["clean", "{input}", "{out}.pdf", "-garbage", "3", "-compress"],
+    "join": ["join", "{input}", "{input}", "-output", "{out}.pdf"],
+}
+
+
+def make_synthetic(folder, count, pages, seed=0):
+    """Create a reproducible corpus of PDFs for 'bench'.
+
+    Every page is built like the one of 'textmaker.py': header, footer and
+    two text columns, filled in "unnatural" sequence. In addition, every
+    page shows an image. All fonts are embedded.
+    """
+    rnd = random.Random(seed)
+    words = (
+        "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+        "tempor incididunt ut labore et dolore magna aliqua ut enim ad minim "
+        "veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea "
+        "commodo consequat duis aute irure in reprehenderit voluptate velit"
+    ).split()
+    font = fitz.Font("tiro")
+    files = []
+    for i in range(count):
+        doc = fitz.open()
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+        pix.set_rect(pix.irect, (rnd.randrange(256), 128, 64))
+        image = pix.tobytes("png")
+        for _ in range(pages):
+            page = doc.new_page()
+            printrect = page.rect + (36, 36, -36, -36)
+            headrect = fitz.Rect(printrect.tl, printrect.x1, printrect.y0 + 36)
+            footrect = fitz.Rect(printrect.x0, printrect.y1 - 36, printrect.br)
+            textrect = fitz.Rect(headrect.bl, footrect.tr)
+            leftrect = textrect + (0, 0, -textrect.width / 2 - 9, 0)
+            rightrect = textrect + (textrect.width / 2 + 9, 0, 0, 0)
+            tw = fitz.TextWriter(page.rect)
+            for rect, n in ((footrect, 5), (rightrect, 300), (leftrect, 300), (headrect, 5)):
+                text = " ".join([rnd.choice(words) for _ in range(n)])
+                tw.fill_textbox(rect, text, font=font, fontsize=9)
+            tw.write_text(page)
+            imgrect = fitz.Rect(headrect.x1 - 36, headrect.y0, headrect.br)
+            page.insert_image(imgrect, stream=image)
+        filename = os.path.join(folder, "synthetic-%i.pdf" % i)
+        doc.save(filename, garbage=3, deflate=True)
+        doc.close()
+        files.append(filename)
+    return files
+
+
+def bench_worker(op, files, warmup, repeat, folder):
+    """Execute one benchmark operation in a separate process.
+
+    Returns:
+        (durations, peak RSS): one list of per-file durations per repetition
+        and the peak resident memory of the process in bytes (None if this
+        cannot be determined).
+    """
+    parser = make_parser()
+    durations = []
+    for rep in range(warmup + repeat):
+        times = []
+        for i, filename in enumerate(files):
+            out = os.path.join(folder, "%s-%i" % (op, i))
+            if op in ("images", "fonts") and not os.path.exists(out):
+                os.mkdir(out)
+            argv = [
+                arg.replace("{input}", filename).replace("{out}", out)
+                for arg in BENCH_OPS[op]
+            ]
+            args = parser.parse_args(argv)
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                args.func(args)
+            times.append(time.perf_counter() - t0)
+        if rep >= warmup:
+            durations.append(times)
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024  # Linux reports KB
+    return durations, peak
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a list (nearest rank)."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def bench(args):
+    """Measure the throughput of fitzcli operations on a corpus."""
+    ops = args.ops.split(",")
+    for op in ops:
+        if op not in BENCH_OPS:
+            sys.exit("unknown operation '%s', choose from %s" % (op, ", ".join(BENCH_OPS)))
+    folder = tempfile.mkdtemp(prefix="fitzcli-bench-")
+    try:
+        report = bench_run(args, ops, folder)
+    finally:
+        shutil.rmtree(folder)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def bench_run(args, ops, folder):
+    """Execute the benchmark using 'folder' for all files, return the report."""
+    files = list(args.input)
+    if args.from_dir:
+        files += sorted(glob.glob(os.path.join(args.from_dir, "*.pdf")))
+    if args.synthetic:
+        files += make_synthetic(folder, args.synthetic, args.synthetic_pages)
+    if not files:
+        sys.exit("no input files")
+
+    pages = 0
+    for filename in files:
+        doc = open_file(filename, None, pdf=True)
+        pages += doc.page_count
+        doc.close()
+    size = sum([os.path.getsize(f) for f in files])
+    report = {
+        "pymupdf": fitz.VersionBind,
+        "mupdf": fitz.VersionFitz,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpus": os.cpu_count(),
+        "corpus": {
+            "files": len(files),
+            "pages": pages,
+            "bytes": size,
+            "synthetic": args.synthetic,
+        },
+        "warmup": args.warmup,
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for op in ops:
+        # a fresh process per operation, so peak memory is measured per op
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(
+                bench_worker, op, files, args.warmup, args.repeat, folder
+            )
+            durations, peak = future.result()
+        total = sum([sum(times) for times in durations])
+        per_file = [t for times in durations for t in times]
+        report["results"][op] = {
+            "seconds": round(total / args.repeat, 4),
+            "pages_per_sec": round(pages * args.repeat / total, 2),
+            "mb_per_sec": round(size * args.repeat / total / 1024 / 1024, 3),
+            "peak_rss_mb": None if peak is None else round(peak / 1024 / 1024, 1),
+            "p50": round(percentile(per_file, 50), 5),
+            "p90": round(percentile(per_file, 90), 5),
+            "p99": round(percentile(per_file, 99), 5),
+        }
+    return report
+
+
+def make_parser():
     """Define command configurations."""
     parser = argparse.ArgumentParser(
         prog="fitz",
         description=mycenter("Basic PyMuPDF Functions"),
     )
+    parser.add_argument(
+        "-profile",
+        help="write timing and memory per phase to this JSON (Chrome trace) file",
+    )
+    parser.add_argument(
+        "-cprofile", help="write cProfile statistics of the command to this file"
+    )
     subps = parser.add_subparsers(
-        title="Subcommands", help="Enter 'command -h' for subcommand specific help"
+        title="Subcommands",
+        dest="command",
+        help="Enter 'command -h' for subcommand specific help",
     )
 
     # -------------------------------------------------------------------------
@@ -931,6 +2111,28 @@ def main():
     )
     ps_show.set_defaults(func=show)
 
+    # -------------------------------------------------------------------------
+    # 'stats' command
+    # -------------------------------------------------------------------------
+    ps_stats = subps.add_parser(
+        "stats", description=mycenter("report PDF object statistics as JSON")
+    )
+    ps_stats.add_argument("input", type=str, help="PDF filename")
+    ps_stats.add_argument("-password", help="password")
+    ps_stats.add_argument(
+        "-top", type=int, default=20, help="list this many largest streams (default 20)"
+    )
+    ps_stats.add_argument(
+        "-decode",
+        action="store_true",
+        help="decode streams to get exact uncompressed sizes (slow)",
+    )
+    ps_stats.add_argument(
+        "-mmap", action="store_true", help="memory-map the input file"
+    )
+    ps_stats.add_argument("-output", help="JSON output file (default stdout)")
+    ps_stats.set_defaults(func=stats)
+
     # -------------------------------------------------------------------------
     # 'clean' command
     # -------------------------------------------------------------------------
@@ -1023,6 +2225,17 @@ def main():
     ps_extract.add_argument(
         "-pages", type=str, help="consider these pages only, format: 1,5-7,50-N"
     )
+    ps_extract.add_argument(
+        "-dedup",
+        action="store_true",
+        help="store objects under their content hash, write an xref manifest",
+    )
+    ps_extract.add_argument(
+        "-jobs",
+        type=int,
+        help="number of worker processes (default 1)",
+        default=1,
+    )
     ps_extract.set_defaults(func=extract_objects)
 
     # -------------------------------------------------------------------------
@@ -1174,9 +2387,16 @@ def main():
         help="suppress pages with no text (default False)",
         default=False,
     )
+    ps_gettext.add_argument(
+        "-format",
+        type=str,
+        help="output format: text (default) or jsonl, one record per page",
+        choices=("text", "jsonl"),
+        default="text",
+    )
     ps_gettext.add_argument(
         "-output",
-        help="store text in this file (default inputfilename.txt)",
+        help="store text in this file, '-' is stdout (default inputfilename.txt)",
     )
     ps_gettext.add_argument(
         "-grid",
@@ -1190,16 +2410,173 @@ def main():
         help="only include text with a larger fontsize (default 3)",
         default=3,
     )
+    ps_gettext.add_argument(
+        "-cache",
+        help="reuse text of unchanged pages from this cache database",
+    )
+    ps_gettext.add_argument(
+        "-cache-size",
+        type=float,
+        help="maximum text size in MB kept in the cache (default 1024)",
+        default=1024,
+    )
+    ps_gettext.add_argument(
+        "-jobs",
+        type=int,
+        help="number of worker processes (default 1)",
+        default=1,
+    )
     ps_gettext.set_defaults(func=gettext)
 
+    # -------------------------------------------------------------------------
+    # 'batch' command
+    # -------------------------------------------------------------------------
+    ps_batch = subps.add_parser(
+        "batch",
+        description=mycenter("execute a command for many input files"),
+        epilog="in 'args' use {dir}, {name}, {stem} for the input's folder, "
+        "filename without extension and path without extension. Options of "
+        "batch may also follow the command - except '-jobs', which then is an "
+        "option of the command",
+    )
+    ps_batch.add_argument(
+        "command",
+        choices=BATCH_COMMANDS,
+        help="command to execute for each input file",
+    )
+    ps_batch.add_argument("-from-dir", help="process the files in this folder")
+    ps_batch.add_argument(
+        "-from-list", help="process the files listed in this file, one per line"
+    )
+    ps_batch.add_argument(
+        "-pattern",
+        help="filename pattern for '-from-dir' (default *.pdf)",
+        default="*.pdf",
+    )
+    ps_batch.add_argument(
+        "-recursive", action="store_true", help="include subfolders of '-from-dir'"
+    )
+    ps_batch.add_argument(
+        "-jobs",
+        type=int,
+        help="number of worker processes (default CPU count)",
+        default=os.cpu_count(),
+    )
+    ps_batch.add_argument(
+        "-manifest",
+        help="JSONL file recording the result per file (default manifest.jsonl)",
+        default="manifest.jsonl",
+    )
+    ps_batch.add_argument(
+        "-resume",
+        action="store_true",
+        help="skip files recorded as done in the manifest",
+    )
+    ps_batch.add_argument(
+        "args", nargs=argparse.REMAINDER, help="further arguments of the command"
+    )
+    ps_batch.set_defaults(func=batch)
+
+    # -------------------------------------------------------------------------
+    # 'serve' command
+    # -------------------------------------------------------------------------
+    ps_serve = subps.add_parser(
+        "serve",
+        description=mycenter("execute commands received on a UNIX socket"),
+    )
+    ps_serve.add_argument(
+        "-socket",
+        help="UNIX socket to listen on (default fitzcli.sock)",
+        default="fitzcli.sock",
+    )
+    ps_serve.add_argument(
+        "-jobs",
+        type=int,
+        help="number of worker processes (default CPU count)",
+        default=os.cpu_count(),
+    )
+    ps_serve.set_defaults(func=serve)
+
+    # -------------------------------------------------------------------------
+    # 'client' command
+    # -------------------------------------------------------------------------
+    ps_client = subps.add_parser(
+        "client",
+        description=mycenter("let a 'serve' process execute a command"),
+    )
+    ps_client.add_argument(
+        "-socket",
+        help="UNIX socket of the server (default fitzcli.sock)",
+        default="fitzcli.sock",
+    )
+    ps_client.add_argument("command", choices=BATCH_COMMANDS, help="command to execute")
+    ps_client.add_argument(
+        "args", nargs=argparse.REMAINDER, help="arguments of the command"
+    )
+    ps_client.set_defaults(func=client)
+
+    # -------------------------------------------------------------------------
+    # 'bench' command
+    # -------------------------------------------------------------------------
+    ps_bench = subps.add_parser(
+        "bench",
+        description=mycenter("measure the performance of fitzcli operations"),
+        epilog="operations: %s" % ", ".join(BENCH_OPS),
+    )
+    ps_bench.add_argument("input", nargs="*", help="PDF filenames")
+    ps_bench.add_argument("-from-dir", help="include the PDFs in this folder")
+    ps_bench.add_argument(
+        "-synthetic",
+        type=int,
+        help="include this many generated, reproducible PDFs",
+        default=0,
+    )
+    ps_bench.add_argument(
+        "-synthetic-pages",
+        type=int,
+        help="page count of each generated PDF (default 10)",
+        default=10,
+    )
+    ps_bench.add_argument(
+        "-ops",
+        help="comma-separated operations (default all)",
+        default=",".join(BENCH_OPS),
+    )
+    ps_bench.add_argument(
+        "-warmup", type=int, help="unmeasured passes (default 1)", default=1
+    )
+    ps_bench.add_argument(
+        "-repeat", type=int, help="measured passes (default 3)", default=3
+    )
+    ps_bench.add_argument("-output", help="JSON report file (default stdout)")
+    ps_bench.set_defaults(func=bench)
+    return parser
+
+
+def main():
+    parser = make_parser()
     # -------------------------------------------------------------------------
     # start program
     # -------------------------------------------------------------------------
     args = parser.parse_args()  # create parameter arguments class
     if not hasattr(args, "func"):  # no function selected
         parser.print_help()  # so print top level help
-    else:
-        args.func(args)  # execute requested command
+        return
+    global profiler
+    if args.profile:
+        profiler = Profiler()
+    cprofiler = cProfile.Profile() if args.cprofile else None
+    try:
+        if cprofiler:
+            cprofiler.enable()
+        with phase(args.command):
+            args.func(args)  # execute requested command
+    finally:
+        if cprofiler:
+            cprofiler.disable()
+            cprofiler.dump_stats(args.cprofile)
+        if profiler:
+            profiler.save(args.profile)
 
 
 if __name__ == "__main__":
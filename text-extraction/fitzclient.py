@@ -0,0 +1,66 @@
+"""
+Utility
+--------
+Lightweight client for 'python fitzcli.py serve'.
+
+Sends a fitzcli command to the server listening on a UNIX socket and prints
+the command's output. Only standard library modules are imported - not even
+PyMuPDF - so startup is as fast as Python permits.
+
+Existing invocations only need to change their prefix:
+
+python fitzcli.py gettext -mode simple input.pdf
+
+becomes
+
+python fitzclient.py [-socket fitzcli.sock] gettext -mode simple input.pdf
+
+The exit code is 0 on success, 1 otherwise. Error messages go to stderr.
+"""
+import json
+import os
+import socket
+import sys
+
+
+def request(socket_path, argv):
+    """Submit a command line to the server and return its result record."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        message = {"argv": argv, "cwd": os.getcwd()}
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        response = sock.makefile("rb").readline()
+    return json.loads(response)
+
+
+def run(socket_path, argv):
+    """Execute a command line via the server, return the exit code."""
+    try:
+        record = request(socket_path, argv)
+    except OSError as e:
+        print("cannot connect to '%s': %s" % (socket_path, e), file=sys.stderr)
+        return 1
+    except ValueError:  # empty or truncated reply
+        print("server closed the connection without a result", file=sys.stderr)
+        return 1
+    sys.stdout.write(record.get("stdout", ""))
+    sys.stderr.write(record.get("stderr", ""))
+    if record.get("status") != "ok":
+        print(record.get("error", "unknown error"), file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = "fitzcli.sock"
+    if argv[:1] == ["-socket"]:
+        socket_path = argv[1]
+        argv = argv[2:]
+    if not argv:
+        sys.exit("usage: fitzclient.py [-socket SOCKET] command [args ...]")
+    sys.exit(run(socket_path, argv))
+
+
+if __name__ == "__main__":
+    main()
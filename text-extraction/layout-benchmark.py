@@ -0,0 +1,97 @@
+"""
+Utility
+--------
+Measure the speed of the layout-preserving text extraction of 'fitzcli.py'.
+
+Every page of the input is extracted with modes "simple" and "layout" of the
+current 'fitzcli.py' and optionally with the "layout" mode of a reference
+version of that script - typically a previous one, e.g. obtained via
+
+git show <revision>:text-extraction/fitzcli.py > fitzcli_ref.py
+
+When a reference is given, the outputs of both layout versions are compared
+and must be identical.
+
+If no input file is given, a dense, spreadsheet-like page with more than
+20,000 characters is generated and used instead.
+
+On this page, the array-based layout code is only about 1.2 to 1.3 times
+as fast as the previous version, with identical output. Roughly 40% of the
+time is spent inside MuPDF creating the TextPage and its "rawdict", which
+the layout code cannot avoid: per character, it needs the origin and width
+that only "rawdict" delivers in TextPage sequence.
+
+Usage
+------
+python layout-benchmark.py [-input file.pdf] [-reference fitzcli_ref.py] [-repeat 3]
+"""
+import argparse
+import importlib.util
+import io
+import os
+import time
+import fitz
+
+import fitzcli
+
+
+def load_reference(filename):
+    """Import another version of fitzcli from a file."""
+    spec = importlib.util.spec_from_file_location("fitzcli_ref", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_dense_document(rows=120, cols=16):
+    """Make a one-page PDF looking like a printed spreadsheet."""
+    doc = fitz.open()
+    page = doc.new_page(width=cols * 50 + 72, height=rows * 7 + 72)
+    for i in range(rows):
+        y = 36 + (i + 1) * 7
+        for j in range(cols):
+            x = 36 + j * 50
+            page.insert_text((x, y), "%11.2f" % ((i + 1) * (j + 7) * 3.14159), fontsize=6)
+    return fitz.open("pdf", doc.tobytes())
+
+
+def run(doc, func, repeat):
+    """Extract all pages 'repeat' times, return best duration and the text."""
+    flags = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE
+    best = None
+    for _ in range(repeat):
+        textout = io.BytesIO()
+        t0 = time.perf_counter()
+        for page in doc:
+            func(page, textout, 2, 3, False, False, flags)
+        t1 = time.perf_counter() - t0
+        best = t1 if best is None else min(best, t1)
+    return best, textout.getvalue()
+
+
+parser = argparse.ArgumentParser(description="benchmark fitzcli layout mode")
+parser.add_argument("-input", help="document to use (default: generated page)")
+parser.add_argument("-reference", help="other fitzcli version to compare with")
+parser.add_argument("-repeat", type=int, default=3, help="repetitions (default 3)")
+args = parser.parse_args()
+
+if args.input:
+    doc = fitz.open(args.input)
+else:
+    doc = make_dense_document()
+chars = sum([len(page.get_text("text")) for page in doc])
+print("%i pages, %i characters" % (doc.page_count, chars))
+
+t_simple, _ = run(doc, fitzcli.page_simple, args.repeat)
+t_layout, text = run(doc, fitzcli.page_layout, args.repeat)
+print("simple:    %.4f sec" % t_simple)
+print("layout:    %.4f sec (%.1f x simple)" % (t_layout, t_layout / t_simple))
+
+if args.reference:
+    ref = load_reference(args.reference)
+    t_ref, ref_text = run(doc, ref.page_layout, args.repeat)
+    print("reference: %.4f sec (%.1f x simple)" % (t_ref, t_ref / t_simple))
+    print("speedup:   %.2f" % (t_ref / t_layout))
+    if ref_text != text:
+        raise ValueError("layout output differs from '%s'" % os.path.basename(args.reference))
+    print("layout output is identical")
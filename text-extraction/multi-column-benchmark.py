@@ -0,0 +1,106 @@
+"""
+Utility
+--------
+Measure the speed of 'column_boxes()' of 'multi_column.py'.
+
+Every page of the input is analyzed by the current 'multi_column.py' and
+optionally by a reference version of that script - typically a previous one,
+e.g. obtained via
+
+git show <revision>:text-extraction/multi_column.py > multi_column_ref.py
+
+When a reference is given, the bboxes found by both versions are compared
+and must be identical.
+
+If no input file is given, path-heavy pages are generated and used instead:
+two text columns, a form-like area with thousands of cell borders, and text
+on colored backgrounds.
+
+Usage
+------
+python multi-column-benchmark.py [-input file.pdf] [-reference multi_column_ref.py] [-repeat 3]
+"""
+import argparse
+import importlib.util
+import os
+import time
+import fitz
+
+import multi_column
+
+
+def load_reference(filename):
+    """Import another version of multi_column from a file."""
+    spec = importlib.util.spec_from_file_location("multi_column_ref", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_path_document(pages=3, cells=40):
+    """Make PDF pages with text columns and many vector graphics."""
+    text = " ".join(["Lorem ipsum dolor sit amet, consectetur adipiscing elit."] * 12)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        width = page.rect.width
+        # two columns of text in the upper part
+        for x in (50, width / 2 + 10):
+            rect = fitz.Rect(x, 60, x + width / 2 - 60, 260)
+            page.insert_textbox(rect, text, fontsize=8)
+
+        # text on a colored background
+        shape = page.new_shape()
+        shape.draw_rect(fitz.Rect(50, 270, width - 50, 330))
+        shape.finish(fill=(0.9, 0.9, 1))
+        shape.commit()
+        page.insert_textbox(fitz.Rect(60, 275, width - 60, 325), text[:300], fontsize=8)
+
+        # form-like area: every cell border is a separate path
+        shape = page.new_shape()
+        size = (width - 100) / cells
+        for i in range(cells):
+            for j in range(cells // 2):
+                shape.draw_rect(fitz.Rect(0, 0, size, size) + (50 + i * size, 340 + j * size) * 2)
+                shape.finish(color=(0, 0, 0), width=0.3)
+        shape.commit()
+        for j in range(0, cells // 2, 2):
+            page.insert_text((52, 340 + (j + 1) * size - 2), "Field %i" % j, fontsize=6)
+    return fitz.open("pdf", doc.tobytes())
+
+
+def run(doc, func, repeat):
+    """Analyze all pages 'repeat' times, return best duration and the bboxes."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = [func(page) for page in doc]
+        t1 = time.perf_counter() - t0
+        best = t1 if best is None else min(best, t1)
+    return best, result
+
+
+parser = argparse.ArgumentParser(description="benchmark multi_column.column_boxes")
+parser.add_argument("-input", help="document to use (default: generated pages)")
+parser.add_argument("-reference", help="other multi_column version to compare with")
+parser.add_argument("-repeat", type=int, default=3, help="repetitions (default 3)")
+args = parser.parse_args()
+
+if args.input:
+    doc = fitz.open(args.input)
+else:
+    doc = make_path_document()
+paths = sum([len(page.get_drawings()) for page in doc])
+print("%i pages, %i vector paths" % (doc.page_count, paths))
+
+t_new, boxes = run(doc, multi_column.column_boxes, args.repeat)
+print("current:   %.4f sec" % t_new)
+
+if args.reference:
+    ref = load_reference(args.reference)
+    t_ref, ref_boxes = run(doc, ref.column_boxes, args.repeat)
+    print("reference: %.4f sec" % t_ref)
+    print("speedup:   %.2f" % (t_ref / t_new))
+    if ref_boxes != boxes:
+        raise ValueError("bboxes differ from '%s'" % os.path.basename(args.reference))
+    print("bboxes are identical")
@@ -44,19 +44,136 @@ Usage
 
   # bboxes is a list of fitz.IRect objects, that are sort ascending by their y0,
   # then x0 coordinates. Their text content can be extracted by all PyMuPDF
-  # get_text() variants, like for instance the following:
+  # get_text() variants. Parse the page only once by sharing a TextPage
+  # (words crossing a bbox border then go to the bbox with most of them):
+  textpage = page.get_textpage(flags=fitz.TEXTFLAGS_WORDS)
   for rect in bboxes:
-      print(page.get_text(clip=rect, sort=True))
+      print(page.get_text(clip=rect, sort=True, textpage=textpage))
+  ----------------------------------------------------------------------------------
+
+- To read a whole document in column order, use the generator below. Pages
+  are processed by a pool of worker processes and delivered in page order:
+
+  ----------------------------------------------------------------------------------
+  from multi_column import column_texts
+
+  for pno, boxes in column_texts("input.pdf", footer_margin=50, jobs=4):
+      for rect, text in boxes:
+          print(text)
   ----------------------------------------------------------------------------------
 """
+import math
 import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import fitz
 
+from page_analysis import PageAnalysis
+
+
+class RectIndex:
+    """Uniform grid index over a list of rectangles.
+
+    The index refers to a live list of rectangles, which the caller may
+    change. Items may be None. After changing or appending item i of the list,
+    call 'update(i)'. Query methods only use the grid to find candidates,
+    which are then checked exactly like a linear scan would do. So results are
+    always identical to scanning the full list.
+    """
+
+    def __init__(self, rects, bounds, cell=32):
+        """Index 'rects' on a grid of square cells covering 'bounds'.
 
-def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
-    """Determine bboxes which wrap a column."""
-    paths = page.get_drawings()
+        Rectangles outside 'bounds' are assigned to the border cells.
+        """
+        self.rects = rects
+        self.x0 = bounds.x0
+        self.y0 = bounds.y0
+        self.cell = cell
+        self.nx = max(1, math.ceil(bounds.width / cell))
+        self.ny = max(1, math.ceil(bounds.height / cell))
+        self.cells = [set() for _ in range(self.nx * self.ny)]
+        self.ranges = []  # cell range of every indexed item
+        for i in range(len(rects)):
+            self.update(i)
+
+    def _range(self, r):
+        """Return (cx0, cy0, cx1, cy1) of cells touched by rectangle r."""
+        cell = self.cell
+        cx0 = min(max(int((r.x0 - self.x0) // cell), 0), self.nx - 1)
+        cx1 = min(max(int((r.x1 - self.x0) // cell), 0), self.nx - 1)
+        cy0 = min(max(int((r.y0 - self.y0) // cell), 0), self.ny - 1)
+        cy1 = min(max(int((r.y1 - self.y0) // cell), 0), self.ny - 1)
+        return cx0, cy0, cx1, cy1
+
+    def _cells(self, crange):
+        """Yield the cell sets of a cell range."""
+        cx0, cy0, cx1, cy1 = crange
+        for cy in range(cy0, cy1 + 1):
+            row = cy * self.nx
+            for cx in range(cx0, cx1 + 1):
+                yield self.cells[row + cx]
+
+    def update(self, i):
+        """(Re-)index item i of the list after it was set or appended."""
+        while len(self.ranges) <= i:
+            self.ranges.append(None)
+        old = self.ranges[i]
+        if old is not None:
+            for c in self._cells(old):
+                c.discard(i)
+        r = self.rects[i]
+        if r is None:
+            self.ranges[i] = None
+            return
+        # invalid rectangles (x0 > x1 or y0 > y1) yield an empty range here
+        crange = self._range(r)
+        self.ranges[i] = crange
+        for c in self._cells(crange):
+            c.add(i)
+
+    def candidates(self, r):
+        """Return indices of items possibly intersecting rectangle r."""
+        result = set()
+        for c in self._cells(self._range(r)):
+            result |= c
+        return result
+
+    def first_containing(self, bb):
+        """Return 1-based number of the first item containing bb, else 0."""
+        # a containing item must cover the top-left corner of bb
+        cx0, cy0, _, _ = self._range(bb)
+        found = 0
+        for i in self.cells[cy0 * self.nx + cx0]:
+            if found and i + 1 > found:
+                continue
+            r = self.rects[i]
+            if r is not None and bb in r:
+                found = i + 1
+        return found
+
+    def intersects(self, bb):
+        """Return True if some item intersects bb, else return False."""
+        rects = self.rects
+        for i in self.candidates(bb):
+            r = rects[i]
+            if r is not None and not (bb & r).is_empty:
+                return True
+        return False
+
+
+def column_boxes(
+    page, footer_margin=50, header_margin=50, no_image_text=True, analysis=None
+):
+    """Determine bboxes which wrap a column.
+
+    'analysis' is an optional PageAnalysis of the page for sharing extracted
+    drawings, images and text with other utilities.
+    """
+    if analysis is None:
+        analysis = PageAnalysis(page)
+    paths = analysis.drawings
     bboxes = []
 
     # path rectangles
@@ -74,39 +191,32 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
     clip.y1 -= footer_margin  # Remove footer area
     clip.y0 += header_margin  # Remove header area
 
-    def can_extend(temp, bb, bboxlist):
+    def can_extend(temp, bb, bboxlist, index):
         """Determines whether rectangle 'temp' can be extended by 'bb'
         without intersecting any of the rectangles contained in 'bboxlist'.
 
         Items of bboxlist may be None if they have been removed.
+        'index' is the RectIndex of bboxlist.
 
         Returns:
             True if 'temp' has no intersections with items of 'bboxlist'.
         """
-        for b in bboxlist:
-            if not intersects_bboxes(temp, vert_bboxes) and (
-                b == None or b == bb or (temp & b).is_empty
-            ):
+        if not bboxlist:
+            return True
+
+        # never cross vertical text
+        if vert_index.intersects(temp):
+            return False
+
+        for i in index.candidates(temp):
+            b = bboxlist[i]
+            if b == None or b == bb or (temp & b).is_empty:
                 continue
             return False
 
         return True
 
-    def in_bbox(bb, bboxes):
-        """Return 1-based number if a bbox contains bb, else return 0."""
-        for i, bbox in enumerate(bboxes):
-            if bb in bbox:
-                return i + 1
-        return 0
-
-    def intersects_bboxes(bb, bboxes):
-        """Return True if a bbox intersects bb, else return False."""
-        for bbox in bboxes:
-            if not (bb & bbox).is_empty:
-                return True
-        return False
-
-    def extend_right(bboxes, width, path_bboxes, vert_bboxes, img_bboxes):
+    def extend_right(bboxes, width, path_index, vert_index, img_index):
         """Extend a bbox to the right page border.
 
         Whenever there is no text to the right of a bbox, enlarge it up
@@ -115,19 +225,20 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
         Args:
             bboxes: (list[IRect]) bboxes to check
             width: (int) page width
-            path_bboxes: (list[IRect]) bboxes with a background color
-            vert_bboxes: (list[IRect]) bboxes with vertical text
-            img_bboxes: (list[IRect]) bboxes of images
+            path_index: (RectIndex) bboxes with a background color
+            vert_index: (RectIndex) bboxes with vertical text
+            img_index: (RectIndex) bboxes of images
         Returns:
             Potentially modified bboxes.
         """
+        index = RectIndex(bboxes, page.rect)
         for i, bb in enumerate(bboxes):
             # do not extend text with background color
-            if in_bbox(bb, path_bboxes):
+            if path_index.first_containing(bb):
                 continue
 
             # do not extend text in images
-            if in_bbox(bb, img_bboxes):
+            if img_index.first_containing(bb):
                 continue
 
             # temp extends bb to the right page border
@@ -135,13 +246,18 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
             temp.x1 = width
 
             # do not cut through colored background or images
-            if intersects_bboxes(temp, path_bboxes + vert_bboxes + img_bboxes):
+            if (
+                path_index.intersects(temp)
+                or vert_index.intersects(temp)
+                or img_index.intersects(temp)
+            ):
                 continue
 
             # also, do not intersect other text bboxes
-            check = can_extend(temp, bb, bboxes)
+            check = can_extend(temp, bb, bboxes, index)
             if check:
                 bboxes[i] = temp  # replace with enlarged bbox
+                index.update(i)
 
         return [b for b in bboxes if b != None]
 
@@ -189,30 +305,33 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
 
     # sort path bboxes by ascending top, then left coordinates
     path_bboxes.sort(key=lambda b: (b.y0, b.x0))
+    path_index = RectIndex(path_bboxes, page.rect)
 
     # bboxes of images on page, no need to sort them
-    for item in page.get_images():
-        img_bboxes.extend(page.get_image_rects(item[0]))
+    img_bboxes.extend(analysis.image_rects)
+    img_index = RectIndex(img_bboxes, page.rect)
 
     # blocks of text on page
-    blocks = page.get_text(
+    blocks = analysis.get_text(
         "dict",
         flags=fitz.TEXTFLAGS_TEXT,
         clip=clip,
     )["blocks"]
 
     # Make block rectangles, ignoring non-horizontal text
+    vert_index = RectIndex(vert_bboxes, page.rect)
     for b in blocks:
         bbox = fitz.IRect(b["bbox"])  # bbox of the block
 
         # ignore text written upon images
-        if no_image_text and in_bbox(bbox, img_bboxes):
+        if no_image_text and img_index.first_containing(bbox):
             continue
 
         # confirm first line to be horizontal
         line0 = b["lines"][0]  # get first line
         if line0["dir"] != (1, 0):  # only accept horizontal text
             vert_bboxes.append(bbox)
+            vert_index.update(len(vert_bboxes) - 1)
             continue
 
         srect = fitz.EMPTY_IRECT()
@@ -227,11 +346,11 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
             bboxes.append(bbox)
 
     # Sort text bboxes by ascending background, top, then left coordinates
-    bboxes.sort(key=lambda k: (in_bbox(k, path_bboxes), k.y0, k.x0))
+    bboxes.sort(key=lambda k: (path_index.first_containing(k), k.y0, k.x0))
 
     # Extend bboxes to the right where possible
     bboxes = extend_right(
-        bboxes, int(page.rect.width), path_bboxes, vert_bboxes, img_bboxes
+        bboxes, int(page.rect.width), path_index, vert_index, img_index
     )
 
     # immediately return of no text found
@@ -244,9 +363,13 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
     # the final block bboxes on page
     nblocks = [bboxes[0]]  # pre-fill with first bbox
     bboxes = bboxes[1:]  # remaining old bboxes
+    nblocks_index = RectIndex(nblocks, page.rect)
+    bboxes_index = RectIndex(bboxes, page.rect)
 
     for i, bb in enumerate(bboxes):  # iterate old bboxes
         check = False  # indicates unwanted joins
+        if bb != None:
+            bb_background = path_index.first_containing(bb)
 
         # check if bb can extend one of the new blocks
         for j in range(len(nblocks)):
@@ -257,26 +380,30 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
                 continue
 
             # never join across different background colors
-            if in_bbox(nbb, path_bboxes) != in_bbox(bb, path_bboxes):
+            if path_index.first_containing(nbb) != bb_background:
                 continue
 
             temp = bb | nbb  # temporary extension of new block
-            check = can_extend(temp, nbb, nblocks)
+            check = can_extend(temp, nbb, nblocks, nblocks_index)
             if check == True:
                 break
 
         if not check:  # bb cannot be used to extend any of the new bboxes
             nblocks.append(bb)  # so add it to the list
             j = len(nblocks) - 1  # index of it
+            nblocks_index.update(j)
             temp = nblocks[j]  # new bbox added
 
         # check if some remaining bbox is contained in temp
-        check = can_extend(temp, bb, bboxes)
+        check = can_extend(temp, bb, bboxes, bboxes_index)
         if check == False:
             nblocks.append(bb)
+            nblocks_index.update(len(nblocks) - 1)
         else:
             nblocks[j] = temp
+            nblocks_index.update(j)
         bboxes[i] = None
+        bboxes_index.update(i)
 
     # do some elementary cleaning
     nblocks = clean_nblocks(nblocks)
@@ -285,6 +412,109 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
     return nblocks
 
 
+def column_text(
+    page, footer_margin=50, header_margin=50, no_image_text=True, analysis=None
+):
+    """Return a list of (bbox, text) for the column bboxes of a page.
+
+    The text of all bboxes is taken from one TextPage of the whole page, so
+    the page is parsed only once. With a TextPage given, PyMuPDF selects the
+    words of a bbox as a whole: a word is taken if at least half of its
+    rectangle lies inside the bbox. This is not the same as
+    'page.get_text(clip=bbox, sort=True)', which makes a TextPage of the bbox
+    area and selects single characters - text crossing a bbox border may
+    therefore be delivered differently.
+    """
+    bboxes = column_boxes(
+        page,
+        footer_margin=footer_margin,
+        header_margin=header_margin,
+        no_image_text=no_image_text,
+        analysis=analysis,
+    )
+    if bboxes == []:
+        return []
+    textpage = page.get_textpage(flags=fitz.TEXTFLAGS_WORDS)
+    return [
+        (rect, page.get_text(clip=rect, sort=True, textpage=textpage))
+        for rect in bboxes
+    ]
+
+
+def column_text_worker(filename, pages, footer_margin, header_margin, no_image_text):
+    """Process a shard of pages in a separate process.
+
+    Every worker opens its own document. Returns a list of the results of
+    'column_text', one per page, in the sequence of 'pages'.
+    """
+    doc = fitz.open(filename)
+    results = [
+        column_text(doc[pno], footer_margin, header_margin, no_image_text)
+        for pno in pages
+    ]
+    doc.close()
+    return results
+
+
+def column_texts(
+    filename,
+    pages=None,
+    footer_margin=50,
+    header_margin=50,
+    no_image_text=True,
+    jobs=None,
+):
+    """Generate (page_number, [(bbox, text), ...]) for pages of a document.
+
+    Args:
+        filename: (str) name of the document
+        pages: (list[int]) 0-based page numbers, default all pages
+        jobs: (int) number of worker processes, default CPU count
+    Returns:
+        A generator delivering the pages in the sequence of 'pages'. With more
+        than one job, contiguous shards of pages are processed by a pool of
+        worker processes. Only a limited number of shards is in flight at any
+        time, so memory stays bounded independent of the document size.
+    """
+    if pages is None:
+        doc = fitz.open(filename)
+        pages = list(range(doc.page_count))
+        doc.close()
+    else:
+        pages = list(pages)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(pages))
+
+    if jobs <= 1:
+        doc = fitz.open(filename)
+        for pno in pages:
+            yield pno, column_text(doc[pno], footer_margin, header_margin, no_image_text)
+        doc.close()
+        return
+
+    # contiguous shards, several per worker to balance uneven pages
+    size = max(1, min(len(pages) // (jobs * 4), 32))
+    shards = deque([pages[i : i + size] for i in range(0, len(pages), size)])
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = deque()  # (shard, future) in page sequence
+        while shards or futures:
+            while shards and len(futures) < jobs * 2:  # keep workers busy
+                shard = shards.popleft()
+                future = executor.submit(
+                    column_text_worker,
+                    filename,
+                    shard,
+                    footer_margin,
+                    header_margin,
+                    no_image_text,
+                )
+                futures.append((shard, future))
+            shard, future = futures.popleft()
+            for pno, result in zip(shard, future.result()):
+                yield pno, result
+
+
 if __name__ == "__main__":
     """Only for debugging purposes, currently.
 
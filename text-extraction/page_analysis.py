@@ -0,0 +1,60 @@
+"""
+Lazily populated, cached page information shared by page analysis utilities.
+
+Functions like 'column_boxes()' (multi_column.py), 'clean_graphics()'
+(clean_graphics.py) or 'detect_rects()' (detect_graphics.py) all need the
+vector graphics, image positions or text of the same page. Extracting these is
+expensive - especially 'page.get_drawings()' on CAD-like pages.
+A PageAnalysis object extracts each of them at most once, when first needed.
+Pass the same object to all utilities to share the results.
+
+The cached data reflect the page at the time of extraction. Create a new
+object after modifying the page.
+
+Identical copies of this file exist in folders "text-extraction",
+"table-analysis" and "examples/extract-vector-graphics".
+
+Usage
+------
+from page_analysis import PageAnalysis
+
+analysis = PageAnalysis(page)
+bboxes = column_boxes(page, analysis=analysis)
+rects = clean_graphics(page, analysis=analysis)
+"""
+
+
+class PageAnalysis:
+    """Cache of the drawings, image rectangles and text of a page."""
+
+    def __init__(self, page):
+        self.page = page
+        self._drawings = None
+        self._image_rects = None
+        self._texts = {}
+
+    @property
+    def drawings(self):
+        """The list of 'page.get_drawings()'. Must not be modified."""
+        if self._drawings is None:
+            self._drawings = self.page.get_drawings()
+        return self._drawings
+
+    @property
+    def image_rects(self):
+        """List of the rectangles of all images shown on the page."""
+        if self._image_rects is None:
+            rects = []
+            for item in self.page.get_images():
+                rects.extend(self.page.get_image_rects(item[0]))
+            self._image_rects = rects
+        return self._image_rects
+
+    def get_text(self, option="dict", clip=None, flags=None, sort=False):
+        """Return 'page.get_text()' for these arguments. Must not be modified."""
+        key = (option, None if clip is None else tuple(clip), flags, sort)
+        if key not in self._texts:
+            self._texts[key] = self.page.get_text(
+                option, clip=clip, flags=flags, sort=sort
+            )
+        return self._texts[key]